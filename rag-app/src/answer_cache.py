@@ -0,0 +1,196 @@
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from . import metrics
+from .config import (
+    ANSWER_CACHE_DB,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_TTL_S,
+    CONTEXT_MAX_TOKENS,
+    EMBED_DIMENSIONS,
+    EMBED_MODEL,
+    GENERATE_MODEL,
+)
+from .db import ConnectionPool
+from .generate import Citation, GenerateResult
+from .index_holder import index_holder
+from .prompts import SYSTEM_PROMPT_STRICT
+
+
+# Answers keyed by (index generation, retrieved chunk set, models and
+# prompt settings). Within a
+# key, a question hits when its embedding is close enough to a cached one, so
+# "what is the refund policy" and "refund policy?" share one completion.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY,
+    generation INTEGER NOT NULL,
+    chunk_key TEXT NOT NULL,
+    model TEXT NOT NULL,
+    query TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    answer TEXT NOT NULL,
+    citations TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_answers_key ON answers(chunk_key, generation, model);
+CREATE INDEX IF NOT EXISTS idx_answers_last_used ON answers(last_used);
+"""
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        path: Path = ANSWER_CACHE_DB,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        ttl_s: float = ANSWER_CACHE_TTL_S,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+    ) -> None:
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._pool = ConnectionPool(path)
+        with self._pool.writer() as conn:
+            conn.executescript(SCHEMA)
+
+    def get(self, query_vec: np.ndarray, generation: int, chunk_key: str, model: str) -> Optional[GenerateResult]:
+        now = time.time()
+        with self._pool.reader() as conn:
+            rows = conn.execute(
+                "SELECT id, vector, answer, citations FROM answers "
+                "WHERE chunk_key=? AND generation=? AND model=? AND created_at>=?",
+                (chunk_key, generation, model, now - self.ttl_s),
+            ).fetchall()
+        if not rows:
+            return None
+        q = np.asarray(query_vec, dtype=np.float32).reshape(-1)
+        mat = np.vstack([np.frombuffer(r["vector"], dtype=np.float32) for r in rows])
+        sims = mat @ q
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            return None
+        row = rows[best]
+        with self._pool.writer() as conn:
+            conn.execute("UPDATE answers SET last_used=? WHERE id=?", (now, row["id"]))
+        citations = [Citation(**c) for c in json.loads(row["citations"])]
+        return GenerateResult(answer=row["answer"], citations=citations)
+
+    def put(
+        self, query: str, query_vec: np.ndarray, generation: int, chunk_key: str, model: str, result: GenerateResult
+    ) -> None:
+        now = time.time()
+        vec = np.asarray(query_vec, dtype=np.float32).reshape(-1)
+        with self._pool.writer() as conn:
+            conn.execute(
+                "INSERT INTO answers (generation, chunk_key, model, query, vector, answer, citations, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    generation,
+                    chunk_key,
+                    model,
+                    query,
+                    vec.tobytes(),
+                    result.answer,
+                    json.dumps([c.__dict__ for c in result.citations]),
+                    now,
+                    now,
+                ),
+            )
+            self._evict(conn, generation, now)
+
+    def _evict(self, conn, generation: int, now: float) -> None:
+        # Older generations can never hit again; then expire by TTL and trim
+        # least recently used entries down to max_entries
+        conn.execute("DELETE FROM answers WHERE generation < ? OR created_at < ?", (generation, now - self.ttl_s))
+        total = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        if total > self.max_entries:
+            conn.execute(
+                "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used LIMIT ?)",
+                (total - self.max_entries,),
+            )
+
+    def count(self) -> int:
+        with self._pool.reader() as conn:
+            return conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+
+_cache: Optional[AnswerCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    global _cache
+    if ANSWER_CACHE_MAX_ENTRIES <= 0:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnswerCache()
+    return _cache
+
+
+def _chunk_key(retrieved: List[Dict]) -> str:
+    ids = sorted(f"{r['document_id']}#{r['chunk_id']}" for r in retrieved)
+    return hashlib.sha256("\n".join(ids).encode("utf-8")).hexdigest()
+
+
+def _model_key() -> str:
+    # Everything besides the chunks that shapes the answer or the query vector
+    prompt = hashlib.sha256(SYSTEM_PROMPT_STRICT.encode("utf-8")).hexdigest()[:16]
+    return f"{GENERATE_MODEL}|{EMBED_MODEL}@{EMBED_DIMENSIONS}|ctx{CONTEXT_MAX_TOKENS}|{prompt}"
+
+
+class AnswerKey(NamedTuple):
+    query_vec: np.ndarray
+    generation: int
+    chunk_key: str
+    model: str
+
+
+def answer_key(query_vec: Optional[np.ndarray], retrieved: List[Dict]) -> Optional[AnswerKey]:
+    # Taken before generation, so an answer is stored under the index
+    # generation it was retrieved from. query_vec is the embedding retrieval
+    # already computed, so the cache costs no extra embedding call.
+    loaded = index_holder.get()
+    if get_answer_cache() is None or loaded is None or query_vec is None or not retrieved:
+        return None
+    return AnswerKey(query_vec, loaded.generation, _chunk_key(retrieved), _model_key())
+
+
+def lookup_answer(key: Optional[AnswerKey]) -> Optional[GenerateResult]:
+    cache = get_answer_cache()
+    if cache is None or key is None:
+        return None
+    hit = cache.get(key.query_vec, key.generation, key.chunk_key, key.model)
+    metrics.incr("answer_cache.hits" if hit is not None else "answer_cache.misses")
+    return hit
+
+
+def cached_answer(
+    query_vec: Optional[np.ndarray], retrieved: List[Dict]
+) -> Tuple[Optional[AnswerKey], Optional[GenerateResult]]:
+    key = answer_key(query_vec, retrieved)
+    return key, lookup_answer(key)
+
+
+def store_answer(key: Optional[AnswerKey], query: str, result: GenerateResult) -> None:
+    # Only model-generated answers are worth caching; "I don't know" is free
+    cache = get_answer_cache()
+    if cache is None or key is None or not result.citations:
+        return
+    cache.put(query, key.query_vec, key.generation, key.chunk_key, key.model, result)
+
+
+def hit_rate() -> float:
+    counters = metrics.snapshot()
+    hits = counters.get("answer_cache.hits", 0)
+    total = hits + counters.get("answer_cache.misses", 0)
+    return hits / total if total else 0.0
@@ -0,0 +1,434 @@
+import json
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from . import db, metrics
+from .config import (
+    EMBED_DIMENSIONS,
+    EMBED_MODEL,
+    EMBED_PRECISION,
+    GENERATE_MODEL,
+    INDEX_TYPE,
+    K,
+    RERANKER,
+    RETRIEVAL_MODE,
+)
+from .embed_index import (
+    build_faiss_index,
+    clear_query_cache,
+    describe_index,
+    faiss,
+    search_params,
+    truncate_dimensions,
+)
+from .generate import generate_answer
+from .retrieve import retrieve
+from .utils import compute_sha256_bytes, new_id, now_iso
+from .vector_store import PRECISIONS, decode_vectors, encode_vectors, get_vector_store
+
+
+def _stored_vectors() -> np.ndarray:
+    rows = db.all_chunks_with_embeddings()
+    if not rows:
+        return np.zeros((0, 0), dtype=np.float32)
+    # Unit-length float32, copied since the benchmark indexes slices of it
+    return np.array(decode_vectors(get_vector_store().take(np.array([r["vec_row"] for r in rows], dtype=np.int64))))
+
+
+def _recall_at_k(approx: np.ndarray, exact: np.ndarray, k: int) -> float:
+    hits = sum(len(set(a[:k].tolist()) & set(e[:k].tolist()) - {-1}) for a, e in zip(approx, exact))
+    return hits / float(len(exact) * k)
+
+
+def _timed_search(index, queries: np.ndarray, k: int, params) -> Dict[str, Any]:
+    # One query at a time, the way /ask searches
+    latencies: List[float] = []
+    found: List[np.ndarray] = []
+    for q in queries:
+        t0 = time.perf_counter()
+        _, I = index.search(q[None, :], k, params=params)
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+        found.append(I[0])
+    lat = np.array(latencies)
+    return {
+        "ids": np.vstack(found),
+        "latency_ms_p50": float(np.percentile(lat, 50)),
+        "latency_ms_p95": float(np.percentile(lat, 95)),
+    }
+
+
+def ann_report(
+    k: int = 10,
+    num_queries: int = 200,
+    index_types: Sequence[str] = ("flat", "ivf_flat", "ivf_pq", "hnsw"),
+    nprobes: Sequence[int] = (1, 4, 16, 64),
+    ef_searches: Sequence[int] = (16, 32, 64, 128),
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    # Recall@k and latency of each index type against exact flat search over
+    # the stored embeddings. Queries are held out of the indexed set.
+    vectors = _stored_vectors()
+    n = vectors.shape[0]
+    if n < 2:
+        return []
+    rng = np.random.default_rng(seed)
+    nq = min(num_queries, max(1, n // 10))
+    perm = rng.permutation(n)
+    queries, base = vectors[perm[:nq]], vectors[perm[nq:]]
+    ids = np.arange(base.shape[0], dtype=np.int64)
+    k = min(k, base.shape[0])
+
+    exact_index = build_faiss_index(base.copy(), ids, index_type="flat", precision="float32")
+    exact = _timed_search(exact_index, queries, k, None)["ids"]
+
+    report: List[Dict[str, Any]] = []
+    for index_type in index_types:
+        t0 = time.perf_counter()
+        index = build_faiss_index(base.copy(), ids, index_type=index_type)
+        build_s = time.perf_counter() - t0
+        info = describe_index(index)
+        built = info["index_type"]
+        if built in ("ivf_flat", "ivf_pq"):
+            sweep = [("nprobe", v) for v in nprobes]
+        elif built == "hnsw":
+            sweep = [("ef_search", v) for v in ef_searches]
+        else:
+            sweep = [("", None)]
+        for knob, value in sweep:
+            params = search_params(info, **({knob: value} if knob else {}))
+            res = _timed_search(index, queries, k, params)
+            report.append({
+                "requested": index_type,
+                "index_type": built,
+                "param": f"{knob}={value}" if knob else "",
+                "recall_at_k": _recall_at_k(res["ids"], exact, k),
+                "latency_ms_p50": res["latency_ms_p50"],
+                "latency_ms_p95": res["latency_ms_p95"],
+                "build_s": build_s,
+                "k": k,
+                "vectors": int(base.shape[0]),
+                "queries": int(nq),
+            })
+    return report
+
+
+def precision_report(
+    k: int = 10,
+    num_queries: int = 200,
+    precisions: Sequence[str] = tuple(PRECISIONS),
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    # Recall@k of each storage precision against exact float32 search over
+    # the stored embeddings: "store" searches vectors round-tripped through
+    # the vector store encoding, "index" a flat FAISS index at that precision.
+    # Against float32 only if the store holds float32 vectors.
+    vectors = _stored_vectors()
+    n = vectors.shape[0]
+    if n < 2:
+        return []
+    rng = np.random.default_rng(seed)
+    nq = min(num_queries, max(1, n // 10))
+    perm = rng.permutation(n)
+    queries, base = vectors[perm[:nq]], vectors[perm[nq:]]
+    ids = np.arange(base.shape[0], dtype=np.int64)
+    k = min(k, base.shape[0])
+
+    exact_index = build_faiss_index(base.copy(), ids, index_type="flat", precision="float32")
+    exact = _timed_search(exact_index, queries, k, None)["ids"]
+
+    report: List[Dict[str, Any]] = []
+    for precision in precisions:
+        stored = decode_vectors(encode_vectors(base, precision))
+        store_index = build_faiss_index(np.array(stored), ids, index_type="flat", precision="float32")
+        store_ids = _timed_search(store_index, queries, k, None)["ids"]
+        index = build_faiss_index(base.copy(), ids, index_type="flat", precision=precision)
+        res = _timed_search(index, queries, k, None)
+        report.append({
+            "precision": precision,
+            "store_bytes_per_vector": int(base.shape[1] * PRECISIONS[precision].itemsize),
+            "index_bytes_per_vector": len(faiss.serialize_index(index)) / float(base.shape[0]),
+            "store_recall_at_k": _recall_at_k(store_ids, exact, k),
+            "index_recall_at_k": _recall_at_k(res["ids"], exact, k),
+            "latency_ms_p50": res["latency_ms_p50"],
+            "latency_ms_p95": res["latency_ms_p95"],
+            "baseline": get_vector_store().dtype.name,
+            "k": k,
+            "vectors": int(base.shape[0]),
+            "queries": int(nq),
+        })
+    return report
+
+
+def dimension_report(
+    k: int = 10,
+    num_queries: int = 200,
+    dims: Sequence[int] = (256, 512, 1024, 1536),
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    # Recall@k of Matryoshka-truncated embeddings (first d components,
+    # renormalized, as EMBED_DIMENSIONS would produce) against exact search
+    # over the full stored vectors, with flat-index latency at each size.
+    # Sizes above the stored dimension are skipped.
+    vectors = _stored_vectors()
+    n = vectors.shape[0]
+    if n < 2:
+        return []
+    rng = np.random.default_rng(seed)
+    nq = min(num_queries, max(1, n // 10))
+    perm = rng.permutation(n)
+    queries, base = vectors[perm[:nq]], vectors[perm[nq:]]
+    ids = np.arange(base.shape[0], dtype=np.int64)
+    k = min(k, base.shape[0])
+    full = base.shape[1]
+
+    exact_index = build_faiss_index(base.copy(), ids, index_type="flat", precision="float32")
+    exact = _timed_search(exact_index, queries, k, None)["ids"]
+
+    report: List[Dict[str, Any]] = []
+    for dim in sorted(set(int(d) for d in dims if 0 < int(d) <= full)):
+        index = build_faiss_index(
+            truncate_dimensions(base, dim), ids, index_type="flat", normalized=True, precision="float32"
+        )
+        res = _timed_search(index, truncate_dimensions(queries, dim), k, None)
+        report.append({
+            "dim": dim,
+            "bytes_per_vector": int(dim * np.dtype(np.float32).itemsize),
+            "recall_at_k": _recall_at_k(res["ids"], exact, k),
+            "latency_ms_p50": res["latency_ms_p50"],
+            "latency_ms_p95": res["latency_ms_p95"],
+            "baseline_dim": full,
+            "k": k,
+            "vectors": int(base.shape[0]),
+            "queries": int(nq),
+        })
+    return report
+
+
+def _post_json(url: str, payload: Dict[str, Any], timeout: float) -> float:
+    req = urllib.request.Request(
+        url, data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"}
+    )
+    t0 = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        resp.read()
+    return (time.perf_counter() - t0) * 1000.0
+
+
+def ask_load_test(
+    url: str = "http://127.0.0.1:8000/ask",
+    query: str = "What is in the documents?",
+    requests: int = 100,
+    concurrency: int = 16,
+    timeout: float = 60.0,
+) -> Dict[str, Any]:
+    # Fire `requests` POSTs at /ask with `concurrency` in flight; run it
+    # against a server backed by the stub model to measure the app itself
+    latencies: List[float] = []
+    errors = 0
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [pool.submit(_post_json, url, {"query": query}, timeout) for _ in range(requests)]
+        for fut in futures:
+            try:
+                latencies.append(fut.result())
+            except Exception:  # noqa: BLE001
+                errors += 1
+    wall = time.perf_counter() - t0
+    lat = np.array(latencies) if latencies else np.zeros(1)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "wall_s": wall,
+        "throughput_rps": len(latencies) / wall if wall > 0 else 0.0,
+        "latency_ms_p50": float(np.percentile(lat, 50)),
+        "latency_ms_p95": float(np.percentile(lat, 95)),
+        "latency_ms_p99": float(np.percentile(lat, 99)),
+    }
+
+
+_SYLLABLES = ["ka", "lo", "mi", "ra", "tu", "ve", "no", "si", "da", "pe", "zu", "gor", "lin", "tas", "mer", "qui"]
+_FILLER = "the a of and to in is for on with as by at from that this which".split()
+
+
+def _word(rng: np.random.Generator) -> str:
+    return "".join(rng.choice(_SYLLABLES, size=int(rng.integers(2, 4))))
+
+
+def synthetic_corpus(
+    num_docs: int = 50, sentences_per_doc: int = 40, questions_per_doc: int = 2, seed: int = 0
+) -> Dict[str, Any]:
+    # Documents of made-up words, each with its own vocabulary, and questions
+    # built from words of one sentence with that document as the answer.
+    # Meant for the stub model, whose embeddings are bag-of-words.
+    rng = np.random.default_rng(seed)
+    shared = [_word(rng) for _ in range(200)]
+    docs: Dict[str, str] = {}
+    questions: List[Dict[str, Any]] = []
+    for d in range(num_docs):
+        filename = f"synthetic_{d:04d}.txt"
+        topic = [_word(rng) for _ in range(30)]
+        sentences = []
+        for _ in range(sentences_per_doc):
+            words = list(rng.choice(topic, size=6)) + list(rng.choice(shared, size=4)) + list(rng.choice(_FILLER, size=4))
+            rng.shuffle(words)
+            sentences.append(" ".join(words).capitalize() + ".")
+        docs[filename] = " ".join(sentences)
+        for i in rng.choice(len(sentences), size=min(questions_per_doc, len(sentences)), replace=False):
+            terms = [w for w in sentences[i].rstrip(".").lower().split() if w not in _FILLER]
+            questions.append({"question": f"What is said about {' '.join(terms[:6])}?", "doc_hints": [filename]})
+    return {"docs": docs, "questions": questions}
+
+
+def register_documents(files: Dict[str, bytes], dest: Path) -> List[str]:
+    # Writes the files and adds them as PENDING documents, like POST /upload
+    dest.mkdir(parents=True, exist_ok=True)
+    doc_ids = []
+    for name, data in files.items():
+        sha = compute_sha256_bytes(data)
+        if db.get_document_by_sha256(sha):
+            continue
+        doc_id = new_id("doc")
+        path = dest / f"{doc_id}_{name}"
+        path.write_bytes(data)
+        db.upsert_document({
+            "id": doc_id,
+            "filename": name,
+            "ext": name.rsplit(".", 1)[-1].lower(),
+            "path": str(path),
+            "size_bytes": len(data),
+            "sha256": sha,
+            "status": "PENDING",
+            "created_at": now_iso(),
+        })
+        doc_ids.append(doc_id)
+    return doc_ids
+
+
+def _rank_of_first_hit(filenames: List[str], hints: List[str]) -> Optional[int]:
+    for rank, name in enumerate(filenames, start=1):
+        if any(h in name.lower() for h in hints):
+            return rank
+    return None
+
+
+def pipeline_benchmark(
+    questions: List[Dict[str, Any]],
+    requests: int = 200,
+    qps: float = 0.0,
+    concurrency: int = 8,
+    k: int = K,
+    mode: str = RETRIEVAL_MODE,
+    reranker: str = RERANKER,
+    generate: bool = True,
+    cold: bool = True,
+) -> Dict[str, Any]:
+    # In-process run of retrieve (+ generate) over the questions, cycling
+    # through them for `requests` requests with up to `concurrency` in flight.
+    # With qps > 0 requests are sent on a fixed schedule and latency counts
+    # from the scheduled time, so queueing behind slow requests shows up;
+    # qps = 0 sends them back to back. Stage percentiles come from the
+    # app's own timers (metrics.timings), reset at the start. Questions with
+    # doc_hints (filename substrings of the relevant documents) are scored:
+    # recall@k is the share of hinted documents in the top k, MRR uses the
+    # rank of the first relevant chunk.
+    questions = [q for q in questions if q.get("question")]
+    if not questions or requests <= 0:
+        return {}
+    metrics.reset()
+    if cold:
+        # Start without cached query embeddings; repeated questions still
+        # hit the cache once embedded
+        clear_query_cache()
+    recalls: List[float] = []
+    reciprocal_ranks: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def run(i: int, scheduled: Optional[float]) -> None:
+        nonlocal errors
+        if scheduled is None:
+            scheduled = time.perf_counter()
+        item = questions[i % len(questions)]
+        try:
+            retrieved = retrieve(item["question"], k=k, mode=mode, reranker=reranker)
+            if generate:
+                generate_answer(item["question"], [
+                    {
+                        "document_id": r.document_id,
+                        "filename": r.filename,
+                        "chunk_id": r.chunk_id,
+                        "page": r.page,
+                        "text": r.text,
+                        "score": r.score,
+                    }
+                    for r in retrieved
+                ])
+        except Exception:  # noqa: BLE001
+            with lock:
+                errors += 1
+            return
+        metrics.observe("bench.request", (time.perf_counter() - scheduled) * 1000.0)
+        hints = [h.lower() for h in item.get("doc_hints", [])]
+        if hints:
+            names = [r.filename.lower() for r in retrieved]
+            rank = _rank_of_first_hit(names, hints)
+            with lock:
+                recalls.append(sum(any(h in n for n in names) for h in hints) / float(len(hints)))
+                reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = []
+        for i in range(requests):
+            scheduled = None
+            if qps > 0:
+                scheduled = t0 + i / qps
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(pool.submit(run, i, scheduled))
+        for fut in futures:
+            fut.result()
+    wall = time.perf_counter() - t0
+
+    loaded_chunks = len(db.all_chunks_with_embeddings())
+    stages = {
+        name: timing
+        for name, timing in metrics.timings().items()
+        if name.startswith(("retrieve.", "generate.", "bench."))
+    }
+    return {
+        "config": {
+            "requests": requests,
+            "qps": qps,
+            "concurrency": concurrency,
+            "k": k,
+            "mode": mode,
+            "reranker": reranker,
+            "generate": generate,
+            "cold": cold,
+            "questions": len(questions),
+            "chunks": loaded_chunks,
+            "embed_model": EMBED_MODEL,
+            "embed_dimensions": EMBED_DIMENSIONS,
+            "embed_precision": EMBED_PRECISION,
+            "index_type": INDEX_TYPE,
+            "generate_model": GENERATE_MODEL,
+        },
+        "errors": errors,
+        "wall_s": wall,
+        "throughput_rps": (requests - errors) / wall if wall > 0 else 0.0,
+        "quality": {
+            "scored_requests": len(recalls),
+            "recall_at_k": float(np.mean(recalls)) if recalls else None,
+            "mrr": float(np.mean(reciprocal_ranks)) if reciprocal_ranks else None,
+        },
+        "timings": stages,
+    }
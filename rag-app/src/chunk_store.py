@@ -0,0 +1,123 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Optional
+
+import numpy as np
+
+
+# Compact, array-backed metadata for every vector in the FAISS index, sorted
+# by vector_id (the FAISS id). Chunk text stays in SQLite and is only fetched
+# for the final top-k hits.
+@dataclass
+class ChunkTable:
+    vector_id: np.ndarray  # int64, ascending
+    doc_ids: np.ndarray  # unique document ids, str
+    filenames: np.ndarray  # filename per entry of doc_ids, str
+    doc_index: np.ndarray  # int32, row -> position in doc_ids
+    chunk_id: np.ndarray  # int32
+    page: np.ndarray  # int32, -1 when the chunk has no page
+
+    def __len__(self) -> int:
+        return int(self.chunk_id.shape[0])
+
+    def rows_for(self, vector_ids: np.ndarray) -> np.ndarray:
+        # Row position for each vector id, -1 where the id is unknown
+        vector_ids = np.asarray(vector_ids, dtype=np.int64)
+        if len(self) == 0:
+            return np.full(vector_ids.shape, -1, dtype=np.int64)
+        rows = np.searchsorted(self.vector_id, vector_ids)
+        rows = np.minimum(rows, len(self) - 1)
+        return np.where(self.vector_id[rows] == vector_ids, rows, -1)
+
+    def document_id(self, row: int) -> str:
+        return str(self.doc_ids[self.doc_index[row]])
+
+    def filename(self, row: int) -> str:
+        return str(self.filenames[self.doc_index[row]])
+
+    def page_of(self, row: int) -> Optional[int]:
+        p = int(self.page[row])
+        return p if p >= 0 else None
+
+    def without_documents(self, doc_ids: Iterable[str]) -> "ChunkTable":
+        doc_mask = np.isin(self.doc_ids, np.array(list(doc_ids), dtype=str))
+        keep = ~doc_mask[self.doc_index]
+        remap = np.cumsum(~doc_mask, dtype=np.int32) - 1
+        return ChunkTable(
+            vector_id=self.vector_id[keep],
+            doc_ids=self.doc_ids[~doc_mask],
+            filenames=self.filenames[~doc_mask],
+            doc_index=remap[self.doc_index[keep]],
+            chunk_id=self.chunk_id[keep],
+            page=self.page[keep],
+        )
+
+    def vector_ids_for_documents(self, doc_ids: Iterable[str]) -> np.ndarray:
+        doc_mask = np.isin(self.doc_ids, np.array(list(doc_ids), dtype=str))
+        return self.vector_id[doc_mask[self.doc_index]]
+
+    def concat(self, other: "ChunkTable") -> "ChunkTable":
+        vector_id = np.concatenate([self.vector_id, other.vector_id])
+        order = np.argsort(vector_id, kind="stable")
+        doc_index = np.concatenate([self.doc_index, other.doc_index + len(self.doc_ids)]).astype(np.int32)
+        return ChunkTable(
+            vector_id=vector_id[order],
+            doc_ids=np.concatenate([self.doc_ids, other.doc_ids]),
+            filenames=np.concatenate([self.filenames, other.filenames]),
+            doc_index=doc_index[order],
+            chunk_id=np.concatenate([self.chunk_id, other.chunk_id])[order],
+            page=np.concatenate([self.page, other.page])[order],
+        )
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Mapping], filenames: Mapping[str, str]) -> "ChunkTable":
+        doc_positions: Dict[str, int] = {}
+        vector_ids: List[int] = []
+        doc_index: List[int] = []
+        chunk_ids: List[int] = []
+        pages: List[int] = []
+        for r in rows:
+            doc_id = r["document_id"]
+            pos = doc_positions.setdefault(doc_id, len(doc_positions))
+            vector_ids.append(int(r["vector_id"]))
+            doc_index.append(pos)
+            chunk_ids.append(int(r["chunk_id"]))
+            pages.append(int(r["page"]) if r["page"] is not None else -1)
+        doc_ids = list(doc_positions)
+        order = np.argsort(np.array(vector_ids, dtype=np.int64), kind="stable")
+        return cls(
+            vector_id=np.array(vector_ids, dtype=np.int64)[order],
+            doc_ids=np.array(doc_ids, dtype=str),
+            filenames=np.array([filenames.get(d, d) for d in doc_ids], dtype=str),
+            doc_index=np.array(doc_index, dtype=np.int32)[order],
+            chunk_id=np.array(chunk_ids, dtype=np.int32)[order],
+            page=np.array(pages, dtype=np.int32)[order],
+        )
+
+
+def save_chunk_table(table: ChunkTable, file: Path) -> None:
+    # np.savez appends .npz to names without it, so write through a handle
+    with open(file, "wb") as f:
+        np.savez(
+            f,
+            vector_id=table.vector_id,
+            doc_ids=table.doc_ids,
+            filenames=table.filenames,
+            doc_index=table.doc_index,
+            chunk_id=table.chunk_id,
+            page=table.page,
+        )
+
+
+def load_chunk_table(file: Path) -> Optional[ChunkTable]:
+    if not file.exists():
+        return None
+    with np.load(file, allow_pickle=False) as data:
+        return ChunkTable(
+            vector_id=data["vector_id"],
+            doc_ids=data["doc_ids"],
+            filenames=data["filenames"],
+            doc_index=data["doc_index"],
+            chunk_id=data["chunk_id"],
+            page=data["page"],
+        )
@@ -1,16 +1,33 @@
 import json
+import os
+import socket
+import sys
 import time
 from pathlib import Path
 from typing import Optional
 
 import typer
 from rich import print
+from rich.table import Table
 
 from . import db
-from .config import K
-from .generate import generate_answer
-from .retrieve import retrieve
-from .worker import get_status, start_processing
+from .bench import (
+    ann_report,
+    ask_load_test,
+    dimension_report,
+    pipeline_benchmark,
+    precision_report,
+    register_documents,
+    synthetic_corpus,
+)
+from .embed_cache import get_embed_cache, import_npy_cache
+from .embed_index import expected_dimension
+from .config import DB_PATH, EMBED_PRECISION, K, RERANKER, RETRIEVAL_MODE
+from .generate import citations_for, generate_answer, stream_answer
+from .indexer import rebuild_index
+from .retrieve import retrieve, retrieve_many
+from .vector_store import get_vector_store
+from .worker import get_status, run_worker, start_processing, start_workers
 
 
 app = typer.Typer(add_completion=False)
@@ -20,13 +37,19 @@ app = typer.Typer(add_completion=False)
 def ingest_uploads() -> None:
     db.init_db()
     job_id = start_processing()
+    start_workers()
+    _follow_job(job_id)
+
+
+def _follow_job(job_id: str) -> None:
     print(f"[bold green]Started job[/bold green]: {job_id}")
     while True:
         st = get_status(job_id)
         if not st:
             print("Job disappeared")
             break
-        print(f"state={st.state} processed={len(st.processed_docs)}/{len(st.queued_docs)} embedded={st.embedded_chunks}")
+        stages = " ".join(f"{k}={v}" for k, v in st.stages.items())
+        print(f"state={st.state} processed={len(st.processed_docs)}/{len(st.queued_docs)} embedded={st.embedded_chunks} {stages}")
         if st.state in ("done", "error"):
             if st.error:
                 print(f"[red]{st.error}[/red]")
@@ -34,10 +57,37 @@ def ingest_uploads() -> None:
         time.sleep(1)
 
 
+@app.command("worker")
+def worker(once: bool = typer.Option(False, help="Exit once the job queue is empty")) -> None:
+    # Standalone job worker; resumes jobs interrupted by a crash or restart
+    db.init_db()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:cli"
+    print(f"[bold green]Worker[/bold green] {worker_id} waiting for jobs")
+    run_worker(worker_id, once=once)
+
+
+@app.command("reindex")
+def reindex() -> None:
+    db.init_db()
+    indexed = rebuild_index()
+    print(f"[bold green]Indexed[/bold green] {indexed} chunks")
+
+
+@app.command("migrate-embed-cache")
+def migrate_embed_cache(remove: bool = typer.Option(False, help="Delete .npy files once imported")) -> None:
+    imported = import_npy_cache(get_embed_cache(), remove=remove)
+    print(f"[bold green]Imported[/bold green] {imported} cached embeddings")
+
+
 @app.command("ask")
-def ask(question: str, k: int = K) -> None:
+def ask(
+    question: str,
+    k: int = K,
+    mode: str = typer.Option(RETRIEVAL_MODE, help="dense, lexical or hybrid"),
+    reranker: str = typer.Option(RERANKER, help="none, lexical, mmr or cross_encoder"),
+) -> None:
     db.init_db()
-    retrieved = retrieve(question, k=k)
+    retrieved = retrieve(question, k=k, mode=mode, reranker=reranker)
     retrieved_dicts = [
         {
             "document_id": r.document_id,
@@ -49,14 +99,15 @@ def ask(question: str, k: int = K) -> None:
         }
         for r in retrieved
     ]
-    gen = generate_answer(question, retrieved_dicts)
-    print("\n[bold]Answer:[/bold]", gen.answer)
+    print("\n[bold]Answer:[/bold] ", end="")
+    # Print the answer as it streams in; written raw so model text is not read as markup
+    for delta in stream_answer(question, retrieved_dicts):
+        sys.stdout.write(delta)
+        sys.stdout.flush()
+    sys.stdout.write("\n")
     print("\n[bold]Citations:[/bold]")
-    for c in gen.citations[:k]:
-        tag = f"{c.filename}#{c.chunk_id}"
-        if c.page:
-            tag += f" (p. {c.page})"
-        print("-", tag)
+    for c in citations_for(retrieved_dicts)[:k]:
+        print("-", c.tag)
 
 
 @app.command("eval")
@@ -65,17 +116,16 @@ def eval_cmd(path: Path = Path("questions.json")) -> None:
     if not path.exists():
         print(f"No questions at {path}")
         raise typer.Exit(code=1)
-    qs = json.loads(path.read_text())
+    qs = [item for item in json.loads(path.read_text()) if item.get("question")]
     total = 0
     hits = 0
-    for item in qs:
-        q = item.get("question", "")
+    # Retrieval for every question in one batch
+    retrieved = retrieve_many([item["question"] for item in qs])
+    for item, ret in zip(qs, retrieved):
+        q = item["question"]
         hints = [h.lower() for h in item.get("doc_hints", [])]
-        if not q:
-            continue
         total += 1
         print(f"\n[bold cyan]Q:[/bold cyan] {q}")
-        ret = retrieve(q)
         ret_dicts = [
             {
                 "document_id": r.document_id,
@@ -91,7 +141,7 @@ def eval_cmd(path: Path = Path("questions.json")) -> None:
         print("retrieved:", ", ".join(used_ids))
         gen = generate_answer(q, ret_dicts)
         print("answer:", gen.answer)
-        print("citations:", ", ".join([f"{c.filename}#{c.chunk_id}" for c in gen.citations]))
+        print("citations:", ", ".join([c.tag for c in gen.citations]))
         if hints:
             if any(any(h in r["filename"].lower() for h in hints) for r in ret_dicts):
                 hits += 1
@@ -99,6 +149,193 @@ def eval_cmd(path: Path = Path("questions.json")) -> None:
         print(f"\n[bold]Hit-rate:[/bold] {hits}/{total} = {hits/total:.2%}")
 
 
+@app.command("ann-report")
+def ann_report_cmd(k: int = 10, queries: int = 200, out: Optional[Path] = None) -> None:
+    db.init_db()
+    report = ann_report(k=k, num_queries=queries)
+    if not report:
+        print("No embeddings stored yet")
+        raise typer.Exit(code=1)
+    table = Table(title=f"recall@{report[0]['k']} vs exact flat ({report[0]['vectors']} vectors, {report[0]['queries']} queries)")
+    for col in ("index", "param", "recall", "p50 ms", "p95 ms", "build s"):
+        table.add_column(col)
+    for row in report:
+        name = row["index_type"] if row["index_type"] == row["requested"] else f"{row['requested']} -> {row['index_type']}"
+        table.add_row(
+            name,
+            row["param"],
+            f"{row['recall_at_k']:.3f}",
+            f"{row['latency_ms_p50']:.3f}",
+            f"{row['latency_ms_p95']:.3f}",
+            f"{row['build_s']:.2f}",
+        )
+    print(table)
+    if out:
+        out.write_text(json.dumps(report, indent=2))
+        print(f"Wrote {out}")
+
+
+@app.command("precision-report")
+def precision_report_cmd(k: int = 10, queries: int = 200, out: Optional[Path] = None) -> None:
+    db.init_db()
+    report = precision_report(k=k, num_queries=queries)
+    if not report:
+        print("No embeddings stored yet")
+        raise typer.Exit(code=1)
+    first = report[0]
+    table = Table(
+        title=f"recall@{first['k']} vs exact {first['baseline']} ({first['vectors']} vectors, {first['queries']} queries)"
+    )
+    for col in ("precision", "store B/vec", "index B/vec", "store recall", "index recall", "p50 ms", "p95 ms"):
+        table.add_column(col)
+    for row in report:
+        table.add_row(
+            row["precision"],
+            str(row["store_bytes_per_vector"]),
+            f"{row['index_bytes_per_vector']:.0f}",
+            f"{row['store_recall_at_k']:.3f}",
+            f"{row['index_recall_at_k']:.3f}",
+            f"{row['latency_ms_p50']:.3f}",
+            f"{row['latency_ms_p95']:.3f}",
+        )
+    print(table)
+    if out:
+        out.write_text(json.dumps(report, indent=2))
+        print(f"Wrote {out}")
+
+
+@app.command("migrate-precision")
+def migrate_precision() -> None:
+    # Stop the web app and workers first: the vector file is replaced
+    db.init_db()
+    rows = get_vector_store().convert(EMBED_PRECISION)
+    cached = get_embed_cache().convert(EMBED_PRECISION)
+    indexed = rebuild_index()
+    print(f"[bold green]Converted[/bold green] {rows} stored vectors and {cached} cached embeddings to {EMBED_PRECISION}; reindexed {indexed}")
+
+
+@app.command("dimension-report")
+def dimension_report_cmd(
+    k: int = 10, queries: int = 200, dims: str = "256,512,1024,1536", out: Optional[Path] = None
+) -> None:
+    db.init_db()
+    report = dimension_report(k=k, num_queries=queries, dims=[int(d) for d in dims.split(",") if d.strip()])
+    if not report:
+        print("No embeddings stored yet")
+        raise typer.Exit(code=1)
+    first = report[0]
+    table = Table(
+        title=f"recall@{first['k']} vs exact {first['baseline_dim']}-dim ({first['vectors']} vectors, {first['queries']} queries)"
+    )
+    for col in ("dim", "B/vec", "recall", "p50 ms", "p95 ms"):
+        table.add_column(col)
+    for row in report:
+        table.add_row(
+            str(row["dim"]),
+            str(row["bytes_per_vector"]),
+            f"{row['recall_at_k']:.3f}",
+            f"{row['latency_ms_p50']:.3f}",
+            f"{row['latency_ms_p95']:.3f}",
+        )
+    print(table)
+    if out:
+        out.write_text(json.dumps(report, indent=2))
+        print(f"Wrote {out}")
+
+
+@app.command("migrate-dimensions")
+def migrate_dimensions() -> None:
+    # Truncates stored vectors to EMBED_DIMENSIONS so existing documents
+    # needn't be re-embedded. Stop the web app and workers first.
+    db.init_db()
+    store = get_vector_store()
+    rows = store.convert(EMBED_PRECISION, dim=expected_dimension())
+    indexed = rebuild_index()
+    print(f"[bold green]Truncated[/bold green] {rows} stored vectors to {store.dim} dimensions; reindexed {indexed}")
+
+
+@app.command("bench")
+def bench_cmd(
+    questions: Path = Path("questions.json"),
+    synthetic: int = typer.Option(0, help="Generate and ingest this many synthetic documents (empty DB only) instead of reading questions"),
+    requests: int = 200,
+    qps: float = typer.Option(0.0, help="Request rate; 0 sends back to back"),
+    concurrency: int = 8,
+    k: int = K,
+    mode: str = typer.Option(RETRIEVAL_MODE, help="dense, lexical or hybrid"),
+    reranker: str = typer.Option(RERANKER, help="none, lexical, mmr or cross_encoder"),
+    generate: bool = typer.Option(True, help="Also generate answers"),
+    cold: bool = typer.Option(True, help="Clear the query embedding cache first"),
+    seed: int = 0,
+    out: Optional[Path] = None,
+) -> None:
+    # Run against the stub model (OPENAI_BASE_URL) to measure the app itself
+    db.init_db()
+    if synthetic:
+        if db.list_documents():
+            print("--synthetic needs an empty database; point DB_PATH, INDEX_PATH, VECTORS_PATH and CACHE_PATH at a scratch directory")
+            raise typer.Exit(code=1)
+        corpus = synthetic_corpus(num_docs=synthetic, seed=seed)
+        files = {name: text.encode("utf-8") for name, text in corpus["docs"].items()}
+        doc_ids = register_documents(files, DB_PATH.parent / "bench_corpus")
+        start_workers()
+        _follow_job(start_processing(doc_ids))
+        qs = corpus["questions"]
+    else:
+        if not questions.exists():
+            print(f"No questions at {questions}")
+            raise typer.Exit(code=1)
+        qs = json.loads(questions.read_text())
+    report = pipeline_benchmark(
+        qs,
+        requests=requests,
+        qps=qps,
+        concurrency=concurrency,
+        k=k,
+        mode=mode,
+        reranker=reranker,
+        generate=generate,
+        cold=cold,
+    )
+    if not report:
+        print("No questions to run")
+        raise typer.Exit(code=1)
+    quality = report["quality"]
+    table = Table(
+        title=(
+            f"{requests} requests, {report['errors']} errors, {report['throughput_rps']:.1f} req/s; "
+            f"recall@{k} {_fmt(quality['recall_at_k'])}, MRR {_fmt(quality['mrr'])}"
+        )
+    )
+    for col in ("stage", "p50 ms", "p95 ms", "p99 ms", "samples"):
+        table.add_column(col)
+    for name, t in report["timings"].items():
+        table.add_row(name, f"{t['p50_ms']:.2f}", f"{t['p95_ms']:.2f}", f"{t['p99_ms']:.2f}", str(t["samples"]))
+    print(table)
+    if out:
+        out.write_text(json.dumps(report, indent=2))
+        print(f"Wrote {out}")
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:.3f}"
+
+
+@app.command("load-test")
+def load_test_cmd(
+    url: str = "http://127.0.0.1:8000/ask",
+    query: str = "What is in the documents?",
+    requests: int = 100,
+    concurrency: int = 16,
+) -> None:
+    res = ask_load_test(url=url, query=query, requests=requests, concurrency=concurrency)
+    print(
+        f"{res['requests']} requests, concurrency {res['concurrency']}, errors {res['errors']}: "
+        f"{res['throughput_rps']:.1f} req/s, p50 {res['latency_ms_p50']:.0f} ms, "
+        f"p95 {res['latency_ms_p95']:.0f} ms, p99 {res['latency_ms_p99']:.0f} ms"
+    )
+
+
 if __name__ == "__main__":
     app()
 
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import threading
+import weakref
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+from .config import (
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    OPENAI_CONNECT_TIMEOUT_S,
+    OPENAI_KEEPALIVE_S,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE,
+    OPENAI_MAX_RETRIES,
+    OPENAI_TIMEOUT_S,
+)
+
+
+# Process-wide OpenAI clients shared by embedding and generation, so requests
+# reuse pooled keep-alive connections instead of paying TCP/TLS setup.
+_lock = threading.Lock()
+_client: Optional[OpenAI] = None
+# Async clients hold a connection pool bound to the event loop they run on
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+_pid = os.getpid()
+
+
+def _api_key() -> str:
+    return OPENAI_API_KEY or os.getenv("OPENAI_API_KEY", "")
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+        keepalive_expiry=OPENAI_KEEPALIVE_S,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(OPENAI_TIMEOUT_S, connect=OPENAI_CONNECT_TIMEOUT_S)
+
+
+def _check_pid() -> None:
+    # Pooled sockets must not be shared with a forked child
+    global _client, _async_clients, _pid
+    if _pid != os.getpid():
+        _client = None
+        _async_clients = weakref.WeakKeyDictionary()
+        _pid = os.getpid()
+
+
+def get_client() -> OpenAI:
+    global _client
+    with _lock:
+        _check_pid()
+        if _client is None:
+            _client = OpenAI(
+                api_key=_api_key(),
+                base_url=OPENAI_BASE_URL or None,
+                timeout=_timeout(),
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=DefaultHttpxClient(limits=_limits(), timeout=_timeout()),
+            )
+        return _client
+
+
+def get_async_client() -> AsyncOpenAI:
+    loop = asyncio.get_running_loop()
+    with _lock:
+        _check_pid()
+        client = _async_clients.get(loop)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=_api_key(),
+                base_url=OPENAI_BASE_URL or None,
+                timeout=_timeout(),
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=DefaultAsyncHttpxClient(limits=_limits(), timeout=_timeout()),
+            )
+            _async_clients[loop] = client
+        return client
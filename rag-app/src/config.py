@@ -24,9 +24,49 @@ def getenv_float(name: str, default: float) -> float:
 
 
 OPENAI_API_KEY = getenv_str("OPENAI_API_KEY", "")
+# Optional OpenAI-compatible endpoint, e.g. the local stub server (python -m src.stub_openai)
+OPENAI_BASE_URL = getenv_str("OPENAI_BASE_URL", "")
+
+# Shared HTTP clients for the OpenAI API (see clients.py)
+OPENAI_TIMEOUT_S = getenv_float("OPENAI_TIMEOUT_S", 60.0)
+OPENAI_CONNECT_TIMEOUT_S = getenv_float("OPENAI_CONNECT_TIMEOUT_S", 5.0)
+OPENAI_MAX_RETRIES = getenv_int("OPENAI_MAX_RETRIES", 2)
+OPENAI_MAX_CONNECTIONS = getenv_int("OPENAI_MAX_CONNECTIONS", 100)
+OPENAI_MAX_KEEPALIVE = getenv_int("OPENAI_MAX_KEEPALIVE", 20)
+OPENAI_KEEPALIVE_S = getenv_float("OPENAI_KEEPALIVE_S", 30.0)
 
 EMBED_MODEL = getenv_str("EMBED_MODEL", "text-embedding-3-small")
+# Reduced output size for text-embedding-3 models (0 = the model's full size)
+EMBED_DIMENSIONS = getenv_int("EMBED_DIMENSIONS", 0)
 GENERATE_MODEL = getenv_str("GENERATE_MODEL", "gpt-4o-mini")
+# Chat completions in flight at once from the web app
+LLM_CONCURRENCY = getenv_int("LLM_CONCURRENCY", 8)
+# Questions accepted in one /ask_batch request
+ASK_BATCH_MAX_QUERIES = getenv_int("ASK_BATCH_MAX_QUERIES", 64)
+
+# Embedding requests are split into batches bounded by tokens and items and
+# sent concurrently; rate-limited batches retry with exponential backoff.
+EMBED_BATCH_MAX_TOKENS = getenv_int("EMBED_BATCH_MAX_TOKENS", 100_000)
+EMBED_BATCH_MAX_ITEMS = getenv_int("EMBED_BATCH_MAX_ITEMS", 1024)
+EMBED_CONCURRENCY = getenv_int("EMBED_CONCURRENCY", 4)
+EMBED_MAX_RETRIES = getenv_int("EMBED_MAX_RETRIES", 5)
+
+# In-process LRU of query embeddings (entries); 0 disables it
+QUERY_CACHE_SIZE = getenv_int("QUERY_CACHE_SIZE", 4096)
+
+# Ingest pipeline: extraction processes, embedding threads and the depth of
+# the bounded queues between extract -> embed -> persist
+EXTRACT_WORKERS = getenv_int("EXTRACT_WORKERS", min(4, os.cpu_count() or 1))  # 0 = extract in-thread
+EMBED_STAGE_WORKERS = getenv_int("EMBED_STAGE_WORKERS", 2)
+PIPELINE_QUEUE_SIZE = getenv_int("PIPELINE_QUEUE_SIZE", 4)
+# Jobs are queued in SQLite and run by up to JOB_WORKERS worker threads per
+# process. A job whose worker stops heartbeating for JOB_LEASE_S seconds
+# (crash, restart) is picked up again and resumes from its last checkpoint.
+JOB_WORKERS = getenv_int("JOB_WORKERS", 1)
+JOB_LEASE_S = getenv_float("JOB_LEASE_S", 60.0)
+JOB_POLL_S = getenv_float("JOB_POLL_S", 2.0)
+# PDFs are extracted, embedded and persisted in segments of this many pages
+PDF_PAGES_PER_TASK = getenv_int("PDF_PAGES_PER_TASK", 50)
 
 CHUNK_SIZE = getenv_int("CHUNK_SIZE", 800)
 CHUNK_OVERLAP = getenv_int("CHUNK_OVERLAP", 150)
@@ -34,13 +74,56 @@ CHUNK_OVERLAP = getenv_int("CHUNK_OVERLAP", 150)
 K = getenv_int("K", 5)
 RERANK_TOP_M = getenv_int("RERANK_TOP_M", 20)
 CONFIDENCE_THRESHOLD = getenv_float("CONFIDENCE_THRESHOLD", 0.22)
+# Token budget for the retrieved context in the generation prompt (0 = no limit)
+CONTEXT_MAX_TOKENS = getenv_int("CONTEXT_MAX_TOKENS", 3000)
+# dense (FAISS) | lexical (SQLite FTS5 BM25) | hybrid (reciprocal rank fusion of both)
+RETRIEVAL_MODE = getenv_str("RETRIEVAL_MODE", "dense")
+RRF_K = getenv_int("RRF_K", 60)
+# Second stage over the RERANK_TOP_M candidates: none | lexical | mmr | cross_encoder
+RERANKER = getenv_str("RERANKER", "none")
+RERANK_BUDGET_MS = getenv_float("RERANK_BUDGET_MS", 50.0)
+RERANK_BATCH_SIZE = getenv_int("RERANK_BATCH_SIZE", 16)
+RERANK_LEXICAL_WEIGHT = getenv_float("RERANK_LEXICAL_WEIGHT", 0.3)
+MMR_LAMBDA = getenv_float("MMR_LAMBDA", 0.7)
+CROSS_ENCODER_MODEL = getenv_str("CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+# Vector index: flat | ivf_flat | ivf_pq | hnsw
+INDEX_TYPE = getenv_str("INDEX_TYPE", "flat")
+IVF_NLIST = getenv_int("IVF_NLIST", 0)  # 0 = about 4*sqrt(n)
+PQ_M = getenv_int("PQ_M", 64)
+PQ_NBITS = getenv_int("PQ_NBITS", 8)
+HNSW_M = getenv_int("HNSW_M", 32)
+HNSW_EF_CONSTRUCTION = getenv_int("HNSW_EF_CONSTRUCTION", 200)
+NPROBE = getenv_int("NPROBE", 16)
+EF_SEARCH = getenv_int("EF_SEARCH", 64)
+INDEX_TRAIN_SAMPLE = getenv_int("INDEX_TRAIN_SAMPLE", 100_000)
+# Rebuild (retrain) an IVF index once it has grown past this multiple of its training size
+INDEX_RETRAIN_GROWTH = getenv_float("INDEX_RETRAIN_GROWTH", 2.0)
 
 DB_PATH = Path(getenv_str("DB_PATH", "data/rag.db"))
 INDEX_PATH = Path(getenv_str("INDEX_PATH", "data/index"))
 CACHE_PATH = Path(getenv_str("CACHE_PATH", "data/cache"))
+# Chunk embeddings, memory-mapped; chunks.vec_row points into it
+VECTORS_PATH = Path(getenv_str("VECTORS_PATH", str(DB_PATH.parent / "vectors.bin")))
+# float32 | float16 | int8: precision of stored vectors, cached embeddings and
+# the FAISS index. Existing data is converted by `cli migrate-precision`.
+EMBED_PRECISION = getenv_str("EMBED_PRECISION", "float32")
+
+SQLITE_CACHE_MB = getenv_int("SQLITE_CACHE_MB", 64)
+SQLITE_MMAP_MB = getenv_int("SQLITE_MMAP_MB", 256)
 
 UPLOADS_PATH = Path("data/uploads")
-EMBED_CACHE_PATH = CACHE_PATH / "embeddings"
+EMBED_CACHE_PATH = CACHE_PATH / "embeddings"  # legacy per-text .npy files
+EMBED_CACHE_DB = CACHE_PATH / "embeddings.db"
+EMBED_CACHE_MAX_MB = getenv_int("EMBED_CACHE_MAX_MB", 4096)
+
+# Semantic answer cache: reuse an answer when a new question retrieves the
+# same chunks from the same index generation and its embedding is at least
+# ANSWER_CACHE_THRESHOLD cosine-similar to a cached question
+ANSWER_CACHE_DB = CACHE_PATH / "answers.db"
+ANSWER_CACHE_THRESHOLD = getenv_float("ANSWER_CACHE_THRESHOLD", 0.95)
+ANSWER_CACHE_TTL_S = getenv_float("ANSWER_CACHE_TTL_S", 86400.0)
+ANSWER_CACHE_MAX_ENTRIES = getenv_int("ANSWER_CACHE_MAX_ENTRIES", 10000)  # 0 disables
 
 HOST = getenv_str("HOST", "127.0.0.1")
 PORT = getenv_int("PORT", 8000)
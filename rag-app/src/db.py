@@ -1,7 +1,15 @@
+import os
+import re
 import sqlite3
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from .config import DB_PATH
+import numpy as np
+
+from .config import DB_PATH, SQLITE_CACHE_MB, SQLITE_MMAP_MB
+from .vector_store import get_vector_store
 
 
 SCHEMA = [
@@ -25,10 +33,51 @@ SCHEMA = [
         text TEXT,
         page INT,
         embedding BLOB NULL,
+        vector_id INTEGER,
+        vec_row INTEGER,
         FOREIGN KEY(document_id) REFERENCES documents(id)
     );
     """,
     """
+    CREATE INDEX IF NOT EXISTS idx_chunks_document ON chunks(document_id, chunk_id);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        created_at TEXT,
+        claimed_by TEXT,
+        heartbeat_at REAL,
+        total_chunks INT DEFAULT 0,
+        embedded_chunks INT DEFAULT 0,
+        stages TEXT,
+        error TEXT
+    );
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state, created_at);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS job_documents (
+        job_id TEXT,
+        document_id TEXT,
+        position INT,
+        state TEXT NOT NULL DEFAULT 'queued',
+        PRIMARY KEY(job_id, document_id),
+        FOREIGN KEY(job_id) REFERENCES jobs(id)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS document_segments (
+        document_id TEXT,
+        first_page INT,
+        last_page INT,
+        chunk_start INT,
+        chunk_count INT,
+        PRIMARY KEY(document_id, first_page, last_page)
+    );
+    """,
+    """
     CREATE TABLE IF NOT EXISTS settings (
         key TEXT PRIMARY KEY,
         value TEXT
@@ -37,23 +86,196 @@ SCHEMA = [
 ]
 
 
-def get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+# Full-text index over chunks.text for lexical (BM25) retrieval. External
+# content table kept in sync with chunks by triggers, so every write path
+# (ingest, re-processing, deletes) updates it without extra calls.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+    text, content='chunks', content_rowid='rowid', tokenize='unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts(rowid, text) VALUES (new.rowid, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_fts_update AFTER UPDATE OF text ON chunks
+WHEN old.text IS NOT new.text BEGIN
+    INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+    INSERT INTO chunks_fts(rowid, text) VALUES (new.rowid, new.text);
+END;
+"""
+
+FTS_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Bound parameters per statement; SQLite builds before 3.32 allow only 999
+_MAX_PARAMS = 900
+
+
+def _connect(path: Path, check_same_thread: bool = True) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+    conn.execute("PRAGMA temp_store=MEMORY")
     return conn
 
 
+class ConnectionPool:
+    # One long-lived reader connection per thread plus a single writer
+    # connection shared by all threads and serialized by a lock. With WAL,
+    # readers never block on the writer and vice versa.
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+        self._writer_conn: Optional[sqlite3.Connection] = None
+        self._pid = os.getpid()
+
+    def _check_pid(self) -> None:
+        # Connections must not cross a fork; start fresh in a child process
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._write_lock = threading.RLock()
+            self._writer_conn = None
+            self._pid = os.getpid()
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        self._check_pid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = _connect(self.path)
+            self._local.conn = conn
+        yield conn
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        self._check_pid()
+        with self._write_lock:
+            if self._writer_conn is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._writer_conn = _connect(self.path, check_same_thread=False)
+            conn = self._writer_conn
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def close(self) -> None:
+        with self._write_lock:
+            if self._writer_conn is not None:
+                self._writer_conn.close()
+                self._writer_conn = None
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH)
+    return _pool
+
+
+def _reader():
+    return get_pool().reader()
+
+
+def _writer():
+    return get_pool().writer()
+
+
+def get_conn() -> sqlite3.Connection:
+    # Standalone connection with the pool's pragmas, for ad-hoc use
+    return _connect(DB_PATH)
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(chunks)")}
+    if "vector_id" not in cols:
+        conn.execute("ALTER TABLE chunks ADD COLUMN vector_id INTEGER")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_chunks_vector_id ON chunks(vector_id)")
+    _assign_vector_ids(conn)
+    if "vec_row" not in cols:
+        conn.execute("ALTER TABLE chunks ADD COLUMN vec_row INTEGER")
+    _move_embeddings_to_store(conn)
+    has_fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name='chunks_fts'").fetchone() is not None
+    trigger = conn.execute("SELECT sql FROM sqlite_master WHERE type='trigger' AND name='chunks_fts_update'").fetchone()
+    if trigger is not None and "WHEN" not in trigger[0]:
+        # Older trigger reindexed the text on every upsert, changed or not
+        conn.execute("DROP TRIGGER chunks_fts_update")
+    conn.executescript(FTS_SCHEMA)
+    if not has_fts:
+        # Index chunks stored before the FTS table existed
+        conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+
+
+def _assign_vector_ids(conn: sqlite3.Connection) -> None:
+    # vector_id is the FAISS id of a chunk. It comes from a monotonic counter
+    # so an id is never handed out twice, even after chunks are deleted.
+    pending = [r[0] for r in conn.execute("SELECT rowid FROM chunks WHERE vector_id IS NULL ORDER BY rowid")]
+    if not pending:
+        return
+    row = conn.execute("SELECT value FROM settings WHERE key='next_vector_id'").fetchone()
+    start = int(row[0]) if row else 1
+    max_row = conn.execute("SELECT MAX(vector_id) FROM chunks").fetchone()
+    if max_row[0] is not None:
+        start = max(start, int(max_row[0]) + 1)
+    conn.executemany(
+        "UPDATE chunks SET vector_id=? WHERE rowid=?",
+        [(start + i, rowid) for i, rowid in enumerate(pending)],
+    )
+    conn.execute(
+        "INSERT INTO settings(key, value) VALUES ('next_vector_id', ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+        (str(start + len(pending)),),
+    )
+
+
+def _move_embeddings_to_store(conn: sqlite3.Connection, batch_size: int = 5000) -> None:
+    # Older databases kept each vector as a BLOB in chunks.embedding; move
+    # them into the vector store and keep only the row pointer
+    store = get_vector_store()
+    while True:
+        rows = conn.execute(
+            "SELECT rowid, embedding FROM chunks WHERE embedding IS NOT NULL ORDER BY vector_id LIMIT ?",
+            (batch_size,),
+        ).fetchall()
+        if not rows:
+            return
+        vec_rows = store.append(np.vstack([np.frombuffer(r[1], dtype=np.float32) for r in rows]))
+        conn.executemany(
+            "UPDATE chunks SET vec_row=?, embedding=NULL WHERE rowid=?",
+            [(int(v), r[0]) for v, r in zip(vec_rows, rows)],
+        )
+        conn.commit()
+
+
 def init_db() -> None:
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with get_conn() as conn:
+    with _writer() as conn:
         cur = conn.cursor()
         for ddl in SCHEMA:
             cur.executescript(ddl)
-        conn.commit()
+        _migrate(conn)
 
 
 def upsert_document(doc: Dict[str, Any]) -> None:
-    with get_conn() as conn:
+    with _writer() as conn:
         conn.execute(
             """
             INSERT INTO documents (id, filename, ext, path, size_bytes, sha256, status, created_at)
@@ -69,49 +291,47 @@ def upsert_document(doc: Dict[str, Any]) -> None:
             """,
             doc,
         )
-        conn.commit()
 
 
 def insert_chunk(chunk: Dict[str, Any]) -> None:
-    with get_conn() as conn:
+    with _writer() as conn:
         conn.execute(
             """
-            INSERT INTO chunks (id, document_id, chunk_id, text, page, embedding)
-            VALUES (:id, :document_id, :chunk_id, :text, :page, :embedding)
+            INSERT INTO chunks (id, document_id, chunk_id, text, page, vec_row)
+            VALUES (:id, :document_id, :chunk_id, :text, :page, :vec_row)
             ON CONFLICT(id) DO UPDATE SET
                 document_id=excluded.document_id,
                 chunk_id=excluded.chunk_id,
                 text=excluded.text,
                 page=excluded.page,
-                embedding=excluded.embedding;
+                vec_row=excluded.vec_row;
             """,
             chunk,
         )
-        conn.commit()
+        _assign_vector_ids(conn)
 
 
 def update_document_status(doc_id: str, status: str) -> None:
-    with get_conn() as conn:
+    with _writer() as conn:
         conn.execute("UPDATE documents SET status=? WHERE id=?", (status, doc_id))
-        conn.commit()
 
 
 def get_document_by_sha256(sha256: str) -> Optional[sqlite3.Row]:
-    with get_conn() as conn:
+    with _reader() as conn:
         cur = conn.execute("SELECT * FROM documents WHERE sha256=?", (sha256,))
         row = cur.fetchone()
         return row
 
 
 def get_document(doc_id: str) -> Optional[sqlite3.Row]:
-    with get_conn() as conn:
+    with _reader() as conn:
         cur = conn.execute("SELECT * FROM documents WHERE id=?", (doc_id,))
         row = cur.fetchone()
         return row
 
 
 def list_documents() -> List[sqlite3.Row]:
-    with get_conn() as conn:
+    with _reader() as conn:
         cur = conn.execute(
             "SELECT id, filename, ext, path, size_bytes, sha256, status, created_at FROM documents ORDER BY created_at DESC"
         )
@@ -119,7 +339,7 @@ def list_documents() -> List[sqlite3.Row]:
 
 
 def list_documents_with_counts() -> List[Dict[str, Any]]:
-	with get_conn() as conn:
+	with _reader() as conn:
 		cur = conn.execute(
 			"""
 			SELECT d.id, d.filename, d.ext, d.path, d.size_bytes, d.sha256, d.status, d.created_at,
@@ -133,61 +353,244 @@ def list_documents_with_counts() -> List[Dict[str, Any]]:
 
 
 def chunks_for_document(doc_id: str) -> List[sqlite3.Row]:
-    with get_conn() as conn:
+    with _reader() as conn:
         cur = conn.execute(
-            "SELECT id, document_id, chunk_id, text, page, embedding FROM chunks WHERE document_id=? ORDER BY chunk_id",
+            "SELECT id, document_id, chunk_id, text, page, vector_id, vec_row FROM chunks WHERE document_id=? ORDER BY chunk_id",
             (doc_id,),
         )
         return cur.fetchall()
 
 
+_UPSERT_CHUNKS = """
+INSERT INTO chunks (id, document_id, chunk_id, text, page, vec_row)
+VALUES (:id, :document_id, :chunk_id, :text, :page, :vec_row)
+ON CONFLICT(id) DO UPDATE SET
+    document_id=excluded.document_id,
+    chunk_id=excluded.chunk_id,
+    text=excluded.text,
+    page=excluded.page,
+    vec_row=COALESCE(excluded.vec_row, chunks.vec_row);
+"""
+
+
 def insert_chunks_bulk(rows: Iterable[Dict[str, Any]]) -> None:
-    with get_conn() as conn:
-        conn.executemany(
-            """
-            INSERT INTO chunks (id, document_id, chunk_id, text, page, embedding)
-            VALUES (:id, :document_id, :chunk_id, :text, :page, :embedding)
-            ON CONFLICT(id) DO UPDATE SET
-                document_id=excluded.document_id,
-                chunk_id=excluded.chunk_id,
-                text=excluded.text,
-                page=excluded.page,
-                embedding=COALESCE(excluded.embedding, chunks.embedding);
-            """,
-            list(rows),
-        )
-        conn.commit()
+    with _writer() as conn:
+        conn.executemany(_UPSERT_CHUNKS, list(rows))
+        _assign_vector_ids(conn)
+
+
+def embedded_chunk_texts(chunk_ids: List[str]) -> Dict[str, str]:
+    # id -> text for those of the given chunks that already have a vector
+    out: Dict[str, str] = {}
+    with _reader() as conn:
+        for start in range(0, len(chunk_ids), _MAX_PARAMS):
+            batch = chunk_ids[start:start + _MAX_PARAMS]
+            placeholders = ", ".join(["?"] * len(batch))
+            cur = conn.execute(
+                f"SELECT id, text FROM chunks WHERE vec_row IS NOT NULL AND id IN ({placeholders})", batch
+            )
+            out.update((r[0], r[1]) for r in cur.fetchall())
+    return out
 
 
 def all_chunks_with_embeddings() -> List[sqlite3.Row]:
-    with get_conn() as conn:
+    # In vec_row order so the vectors are read from the store sequentially
+    with _reader() as conn:
         cur = conn.execute(
-            "SELECT id, document_id, chunk_id, text, page, embedding FROM chunks WHERE embedding IS NOT NULL ORDER BY document_id, chunk_id"
+            "SELECT id, document_id, chunk_id, page, vector_id, vec_row FROM chunks WHERE vec_row IS NOT NULL ORDER BY vec_row"
         )
         return cur.fetchall()
 
 
+def chunks_with_embeddings_for_documents(doc_ids: List[str]) -> List[sqlite3.Row]:
+    doc_ids = list(doc_ids)
+    rows: List[sqlite3.Row] = []
+    with _reader() as conn:
+        for start in range(0, len(doc_ids), _MAX_PARAMS):
+            batch = doc_ids[start:start + _MAX_PARAMS]
+            placeholders = ", ".join(["?"] * len(batch))
+            cur = conn.execute(
+                f"SELECT id, document_id, chunk_id, page, vector_id, vec_row FROM chunks WHERE vec_row IS NOT NULL AND document_id IN ({placeholders})",
+                batch,
+            )
+            rows.extend(cur.fetchall())
+    # In vec_row order across batches, like all_chunks_with_embeddings()
+    rows.sort(key=lambda r: r["vec_row"])
+    return rows
+
+
+def chunk_metadata() -> List[sqlite3.Row]:
+    # Same rows as all_chunks_with_embeddings(), without text or vectors
+    with _reader() as conn:
+        cur = conn.execute(
+            "SELECT vector_id, document_id, chunk_id, page FROM chunks WHERE vec_row IS NOT NULL ORDER BY vector_id"
+        )
+        return cur.fetchall()
+
+
+def get_chunks_by_vector_ids(vector_ids: List[int]) -> Dict[int, sqlite3.Row]:
+    if not vector_ids:
+        return {}
+    ids = [int(v) for v in vector_ids]
+    out: Dict[int, sqlite3.Row] = {}
+    with _reader() as conn:
+        # Batched retrieval can ask for more ids than SQLite takes parameters
+        for start in range(0, len(ids), _MAX_PARAMS):
+            batch = ids[start:start + _MAX_PARAMS]
+            placeholders = ", ".join(["?"] * len(batch))
+            cur = conn.execute(
+                f"SELECT id, document_id, chunk_id, text, page, vector_id, vec_row FROM chunks WHERE vector_id IN ({placeholders})",
+                batch,
+            )
+            out.update((int(r["vector_id"]), r) for r in cur.fetchall())
+    return out
+
+
+def search_chunks_bm25(query: str, limit: int) -> List[Tuple[int, float]]:
+    # (vector_id, bm25) best first. Query words are quoted and OR-ed so user
+    # text never hits FTS5 syntax; bm25() is lower-is-better.
+    tokens = list(dict.fromkeys(FTS_TOKEN_RE.findall(query.lower())))
+    if not tokens or limit <= 0:
+        return []
+    match = " OR ".join(f'"{t}"' for t in tokens)
+    with _reader() as conn:
+        cur = conn.execute(
+            """
+            SELECT c.vector_id, bm25(chunks_fts) AS score
+            FROM chunks_fts JOIN chunks c ON c.rowid = chunks_fts.rowid
+            WHERE chunks_fts MATCH ? AND c.vector_id IS NOT NULL
+            ORDER BY score
+            LIMIT ?
+            """,
+            (match, limit),
+        )
+        return [(int(r[0]), float(r[1])) for r in cur.fetchall()]
+
+
 def set_setting(key: str, value: str) -> None:
-    with get_conn() as conn:
+    with _writer() as conn:
         conn.execute(
             "INSERT INTO settings(key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
             (key, value),
         )
-        conn.commit()
 
 
 def get_setting(key: str) -> Optional[str]:
-    with get_conn() as conn:
+    with _reader() as conn:
         cur = conn.execute("SELECT value FROM settings WHERE key=?", (key,))
         row = cur.fetchone()
         return row[0] if row else None
 
 
 def find_chunk(document_id: str, chunk_id: int) -> Optional[sqlite3.Row]:
-    with get_conn() as conn:
+    with _reader() as conn:
         cur = conn.execute(
-            "SELECT id, document_id, chunk_id, text, page, embedding FROM chunks WHERE document_id=? AND chunk_id=?",
+            "SELECT id, document_id, chunk_id, text, page, vector_id, vec_row FROM chunks WHERE document_id=? AND chunk_id=?",
             (document_id, chunk_id),
         )
         return cur.fetchone()
 
+
+def create_job(job_id: str, doc_ids: List[str], created_at: str) -> None:
+    with _writer() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, state, created_at) VALUES (?, 'queued', ?)",
+            (job_id, created_at),
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO job_documents (job_id, document_id, position) VALUES (?, ?, ?)",
+            [(job_id, doc_id, i) for i, doc_id in enumerate(doc_ids)],
+        )
+
+
+def claim_job(worker_id: str, now: float, lease_s: float) -> Optional[str]:
+    # Atomically take the oldest queued job, or a processing job whose
+    # worker stopped heartbeating (crash, deploy)
+    with _writer() as conn:
+        row = conn.execute(
+            """
+            UPDATE jobs SET state='processing', claimed_by=?, heartbeat_at=?
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE state='queued' OR (state='processing' AND heartbeat_at < ?)
+                ORDER BY created_at, rowid LIMIT 1
+            )
+            RETURNING id
+            """,
+            (worker_id, now, now - lease_s),
+        ).fetchone()
+        return row[0] if row else None
+
+
+def heartbeat_job(job_id: str, worker_id: str, now: float) -> None:
+    with _writer() as conn:
+        conn.execute("UPDATE jobs SET heartbeat_at=? WHERE id=? AND claimed_by=?", (now, job_id, worker_id))
+
+
+def update_job_progress(job_id: str, total_chunks: int, embedded_chunks: int, stages: str) -> None:
+    with _writer() as conn:
+        conn.execute(
+            "UPDATE jobs SET total_chunks=?, embedded_chunks=?, stages=? WHERE id=?",
+            (total_chunks, embedded_chunks, stages, job_id),
+        )
+
+
+def finish_job(job_id: str, state: str, error: Optional[str] = None) -> None:
+    with _writer() as conn:
+        conn.execute("UPDATE jobs SET state=?, error=?, claimed_by=NULL WHERE id=?", (state, error, job_id))
+
+
+def get_job(job_id: str) -> Optional[sqlite3.Row]:
+    with _reader() as conn:
+        return conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+
+
+def job_documents(job_id: str) -> List[sqlite3.Row]:
+    with _reader() as conn:
+        cur = conn.execute(
+            "SELECT document_id, state FROM job_documents WHERE job_id=? ORDER BY position", (job_id,)
+        )
+        return cur.fetchall()
+
+
+def finish_job_document(job_id: str, doc_id: str, state: str, doc_status: str) -> None:
+    # The document's segment checkpoints are only needed while it is in flight
+    with _writer() as conn:
+        conn.execute("UPDATE job_documents SET state=? WHERE job_id=? AND document_id=?", (state, job_id, doc_id))
+        conn.execute("UPDATE documents SET status=? WHERE id=?", (doc_status, doc_id))
+        conn.execute("DELETE FROM document_segments WHERE document_id=?", (doc_id,))
+
+
+def committed_segments(doc_id: str) -> Dict[Tuple[int, int], int]:
+    with _reader() as conn:
+        cur = conn.execute(
+            "SELECT first_page, last_page, chunk_count FROM document_segments WHERE document_id=?", (doc_id,)
+        )
+        return {(r[0], r[1]): r[2] for r in cur.fetchall()}
+
+
+def insert_segment(
+    job_id: str,
+    doc_id: str,
+    first_page: int,
+    last_page: int,
+    chunk_start: int,
+    chunk_count: int,
+    rows: List[Dict[str, Any]],
+) -> None:
+    # A segment's checkpoint commits together with its new or changed chunks
+    # (rows; unchanged ones aren't rewritten) and the job's embedded count,
+    # so a resumed job can skip it without re-extracting or re-embedding
+    with _writer() as conn:
+        conn.execute("UPDATE jobs SET embedded_chunks=embedded_chunks+? WHERE id=?", (len(rows), job_id))
+        conn.executemany(_UPSERT_CHUNKS, rows)
+        _assign_vector_ids(conn)
+        conn.execute(
+            """
+            INSERT INTO document_segments (document_id, first_page, last_page, chunk_start, chunk_count)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(document_id, first_page, last_page) DO UPDATE SET
+                chunk_start=excluded.chunk_start, chunk_count=excluded.chunk_count
+            """,
+            (doc_id, first_page, last_page, chunk_start, chunk_count),
+        )
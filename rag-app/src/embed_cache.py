@@ -0,0 +1,201 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import EMBED_CACHE_DB, EMBED_CACHE_MAX_MB, EMBED_CACHE_PATH, EMBED_PRECISION
+from .db import ConnectionPool
+from .vector_store import PRECISIONS, decode_vectors, encode_vectors
+
+
+# Single-file embedding cache keyed by (model, sha256 of text). Replaces the
+# one-.npy-per-chunk layout under EMBED_CACHE_PATH. Rows are addressed by a
+# 60-bit integer derived from the key so bulk lookups are rowid probes; model
+# and sha256 are stored to reject the (unlikely) colliding row.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key INTEGER PRIMARY KEY,
+    model TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    last_used INTEGER NOT NULL,
+    dtype TEXT NOT NULL DEFAULT 'float32'
+);
+CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used);
+"""
+
+# SQLite's default limit on host parameters is 999
+_LOOKUP_BATCH = 900
+# Only rewrite last_used for hits older than this, to keep lookups read-mostly
+_TOUCH_GRANULARITY_S = 3600
+
+
+def _row_key(model_salt: int, sha: str) -> int:
+    return int(sha[:15], 16) ^ model_salt
+
+
+def _model_salt(model: str) -> int:
+    return int(hashlib.sha256(model.encode("utf-8")).hexdigest()[:15], 16)
+
+
+class EmbeddingCache:
+    def __init__(
+        self, path: Path = EMBED_CACHE_DB, max_mb: int = EMBED_CACHE_MAX_MB, precision: str = EMBED_PRECISION
+    ) -> None:
+        self._max_bytes = max_mb * 1024 * 1024
+        # New entries are stored in this precision; entries in any precision are read
+        self.precision = precision
+        self._pool = ConnectionPool(path)
+        with self._pool.writer() as conn:
+            conn.executescript(SCHEMA)
+            cols = {r["name"] for r in conn.execute("PRAGMA table_info(embeddings)")}
+            if "dtype" not in cols:
+                conn.execute("ALTER TABLE embeddings ADD COLUMN dtype TEXT NOT NULL DEFAULT 'float32'")
+
+    def get_many(self, model: str, keys: Sequence[str], dim: Optional[int] = None) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        salt = _model_salt(model)
+        # Probe in rowid order so lookups walk the B-tree sequentially
+        row_keys = sorted({_row_key(salt, sha) for sha in keys})
+        now = int(time.time())
+        stale: List[int] = []
+        with self._pool.reader() as conn:
+            for start in range(0, len(row_keys), _LOOKUP_BATCH):
+                batch = row_keys[start:start + _LOOKUP_BATCH]
+                placeholders = ", ".join(["?"] * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, model, sha256, vector, last_used, dtype FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, row_model, sha, blob, last_used, dtype in rows:
+                    if row_model != model:
+                        continue
+                    vec = np.frombuffer(blob, dtype=PRECISIONS[dtype])
+                    if dim is not None and vec.shape[0] != dim:
+                        continue
+                    found[sha] = decode_vectors(vec)[0] if dtype != "float32" else vec
+                    if last_used < now - _TOUCH_GRANULARITY_S:
+                        stale.append(key)
+        if stale:
+            with self._pool.writer() as conn:
+                conn.executemany("UPDATE embeddings SET last_used=? WHERE key=?", [(now, k) for k in stale])
+        return found
+
+    def put_many(self, model: str, items: Iterable[Tuple[str, np.ndarray]]) -> None:
+        now = int(time.time())
+        salt = _model_salt(model)
+        rows = [
+            (_row_key(salt, sha), model, sha, encode_vectors(vec, self.precision).tobytes(), now, self.precision)
+            for sha, vec in items
+        ]
+        if not rows:
+            return
+        rows.sort(key=lambda r: r[0])
+        with self._pool.writer() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, sha256, vector, last_used, dtype) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._evict(conn)
+
+    def used_bytes(self) -> int:
+        with self._pool.reader() as conn:
+            return self._used_bytes(conn)
+
+    @staticmethod
+    def _used_bytes(conn: sqlite3.Connection) -> int:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (pages - free) * page_size
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        # Drop least recently used entries until under the size bound; freed
+        # pages are reused by later inserts.
+        if self._max_bytes <= 0:
+            return
+        while self._used_bytes(conn) > self._max_bytes:
+            total = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if total == 0:
+                return
+            n = max(1, total // 10)
+            conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (n,)
+            )
+            conn.commit()
+
+    def convert(self, precision: str, batch_size: int = 1000) -> int:
+        # Re-encode entries stored in another precision
+        self.precision = precision
+        converted = 0
+        while True:
+            with self._pool.reader() as conn:
+                rows = conn.execute(
+                    "SELECT key, vector, dtype FROM embeddings WHERE dtype != ? LIMIT ?", (precision, batch_size)
+                ).fetchall()
+            if not rows:
+                return converted
+            with self._pool.writer() as conn:
+                conn.executemany(
+                    "UPDATE embeddings SET vector=?, dtype=? WHERE key=?",
+                    [
+                        (encode_vectors(np.frombuffer(blob, dtype=PRECISIONS[dtype]), precision).tobytes(), precision, key)
+                        for key, blob, dtype in rows
+                    ],
+                )
+            converted += len(rows)
+
+    def count(self) -> int:
+        with self._pool.reader() as conn:
+            return conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+def import_npy_cache(
+    cache: "EmbeddingCache", path: Path = EMBED_CACHE_PATH, remove: bool = False, batch_size: int = 1000
+) -> int:
+    # One-off migration of legacy {model}_{sha256}.npy files into the cache
+    imported = 0
+    pending: Dict[str, List[Tuple[str, np.ndarray]]] = {}
+    files: List[Path] = []
+
+    def flush() -> None:
+        for model, items in pending.items():
+            cache.put_many(model, items)
+        pending.clear()
+        if remove:
+            for f in files:
+                f.unlink(missing_ok=True)
+        files.clear()
+
+    for fp in path.glob("*.npy"):
+        model, sep, sha = fp.stem.rpartition("_")
+        if not sep or len(sha) != 64:
+            continue
+        try:
+            vec = np.load(fp)
+        except Exception:  # noqa: BLE001
+            continue
+        pending.setdefault(model, []).append((sha, vec.astype(np.float32)))
+        files.append(fp)
+        imported += 1
+        if len(files) >= batch_size:
+            flush()
+    flush()
+    return imported
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embed_cache() -> EmbeddingCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache()
+    return _cache
@@ -1,5 +1,10 @@
 import json
 import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
@@ -8,91 +13,479 @@ try:
 except Exception as e:  # noqa: BLE001
     faiss = None  # type: ignore
 import numpy as np
-from openai import OpenAI
+from openai import APIConnectionError, APITimeoutError, InternalServerError, OpenAI, RateLimitError
 
-from .config import EMBED_CACHE_PATH, EMBED_MODEL, INDEX_PATH, OPENAI_API_KEY
-from .utils import compute_sha256_bytes
+from . import metrics
+from .chunk_store import ChunkTable, save_chunk_table
+from .clients import get_client
+from .embed_cache import get_embed_cache
+from .config import (
+    EF_SEARCH,
+    EMBED_BATCH_MAX_ITEMS,
+    EMBED_BATCH_MAX_TOKENS,
+    EMBED_CONCURRENCY,
+    EMBED_DIMENSIONS,
+    EMBED_MAX_RETRIES,
+    EMBED_MODEL,
+    EMBED_PRECISION,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_M,
+    INDEX_PATH,
+    INDEX_TRAIN_SAMPLE,
+    INDEX_TYPE,
+    IVF_NLIST,
+    NPROBE,
+    PQ_M,
+    PQ_NBITS,
+    QUERY_CACHE_SIZE,
+)
+from .utils import compute_sha256_bytes, count_tokens, normalize_whitespace
+from .vector_store import decode_vectors, get_vector_store
 
 
 def get_openai_client() -> OpenAI:
-    api_key = OPENAI_API_KEY or os.getenv("OPENAI_API_KEY", "")
-    return OpenAI(api_key=api_key)
-
-
-def embedding_dimension(model: str) -> int:
-    # Known dims for popular OpenAI models
-    if model == "text-embedding-3-small":
-        return 1536
-    if model == "text-embedding-3-large":
-        return 3072
-    # Fallback to 1536 which works for many models
-    return 1536
-
-
-def embed_texts(texts: List[str], model: str = EMBED_MODEL) -> np.ndarray:
-    client = get_openai_client()
-    # Caching per text using content hash keyed by model
-    vectors: List[np.ndarray] = []
-    EMBED_CACHE_PATH.mkdir(parents=True, exist_ok=True)
-    dim = embedding_dimension(model)
-    batch_texts: List[str] = []
-    batch_indices: List[int] = []
-    cached: Dict[int, np.ndarray] = {}
+    # The shared pooled client; _embed_batch does its own backoff, so SDK retries are off
+    return get_client().with_options(max_retries=0)
+
+
+# Native output size of known models. text-embedding-3 models can return
+# fewer dimensions (EMBED_DIMENSIONS): the full vector truncated and
+# renormalized, so shorter vectors stay comparable with each other.
+_NATIVE_DIMS = {"text-embedding-3-small": 1536, "text-embedding-3-large": 3072}
+
+
+def embedding_dimension(model: str, dimensions: int = EMBED_DIMENSIONS) -> int:
+    native = _NATIVE_DIMS.get(model, 1536)  # fallback works for many models
+    if dimensions <= 0:
+        return native
+    if model in _NATIVE_DIMS and dimensions > native:
+        raise ValueError(f"EMBED_DIMENSIONS={dimensions} exceeds the {native} dimensions of {model}")
+    return dimensions
+
+
+def expected_dimension(model: str = EMBED_MODEL) -> Optional[int]:
+    # Dimension an index must have to be searched with this model's queries;
+    # None when it can't be known up front
+    if EMBED_DIMENSIONS > 0:
+        return embedding_dimension(model)
+    return _NATIVE_DIMS.get(model)
+
+
+def manifest_mismatch(meta: Dict[str, str]) -> Optional[str]:
+    # Why an index can't be searched with queries embedded under the current
+    # EMBED_MODEL / EMBED_DIMENSIONS, or None if it can
+    dim = expected_dimension()
+    built_dim = int(meta.get("dim", 0))
+    if meta.get("model") != EMBED_MODEL:
+        # Re-processing skips chunks whose text is unchanged, so vectors from
+        # another model are only replaced by ingesting afresh
+        return (
+            f"Index was built with {meta.get('model')} but EMBED_MODEL is {EMBED_MODEL}; run `reindex` "
+            "if the stored vectors come from it, else ingest into new DB_PATH/INDEX_PATH/VECTORS_PATH"
+        )
+    if dim is not None and built_dim != dim:
+        stored = get_vector_store().dim
+        if stored == dim:
+            fix = "run `reindex`"
+        elif stored is not None and stored > dim:
+            fix = "run `migrate-dimensions`"
+        else:
+            fix = "ingest into new DB_PATH/INDEX_PATH/VECTORS_PATH"
+        return (
+            f"Index has {built_dim}-dim vectors but {EMBED_MODEL} with "
+            f"EMBED_DIMENSIONS={EMBED_DIMENSIONS} gives {dim}; {fix}"
+        )
+    return None
+
+
+def manifest_matches(meta: Dict[str, str]) -> bool:
+    return manifest_mismatch(meta) is None
+
+
+def _cache_model(model: str, dimensions: int) -> str:
+    # Embedding cache key: reduced-dimension vectors are cached apart from
+    # the model's full-size ones, which keep their existing key
+    return f"{model}@{dimensions}" if dimensions > 0 else model
+
+
+def truncate_dimensions(vectors: np.ndarray, dim: int) -> np.ndarray:
+    # Matryoshka truncation: keep the first dim components, renormalize
+    x = np.array(vectors, dtype=np.float32, ndmin=2)
+    if x.shape[1] < dim:
+        raise ValueError(f"Can't truncate {x.shape[1]}-dim vectors to {dim}")
+    x = np.ascontiguousarray(x[:, :dim])
+    x /= np.linalg.norm(x, axis=1, keepdims=True) + 1e-12
+    return x
+
+
+def _token_batches(texts: List[str], model: str) -> List[List[int]]:
+    # Consecutive index ranges bounded by EMBED_BATCH_MAX_TOKENS and
+    # EMBED_BATCH_MAX_ITEMS; an oversized single text still gets its own batch.
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
     for i, t in enumerate(texts):
-        key = f"{model}_{compute_sha256_bytes(t.encode('utf-8'))}.npy"
-        fp = EMBED_CACHE_PATH / key
-        if fp.exists():
-            vec = np.load(fp)
-            if vec.shape[0] != dim:
-                fp.unlink(missing_ok=True)
-            else:
-                cached[i] = vec
-                continue
-        batch_texts.append(t)
-        batch_indices.append(i)
-
-    if batch_texts:
-        resp = client.embeddings.create(model=model, input=batch_texts)
-        for i, data in zip(batch_indices, resp.data):
-            vec = np.array(data.embedding, dtype=np.float32)
-            key = f"{model}_{compute_sha256_bytes(texts[i].encode('utf-8'))}.npy"
-            fp = EMBED_CACHE_PATH / key
-            np.save(fp, vec)
-            cached[i] = vec
+        n = count_tokens(t, model)
+        if current and (current_tokens + n > EMBED_BATCH_MAX_TOKENS or len(current) >= EMBED_BATCH_MAX_ITEMS):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += n
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _retry_delay(attempt: int, err: Exception) -> float:
+    response = getattr(err, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+def _embed_batch(client: OpenAI, texts: List[str], model: str, dimensions: int = 0) -> List[np.ndarray]:
+    kwargs = {"dimensions": dimensions} if dimensions > 0 and model.startswith("text-embedding-3") else {}
+    attempt = 0
+    while True:
+        try:
+            resp = client.embeddings.create(model=model, input=texts, **kwargs)
+            break
+        except (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError) as e:
+            if attempt >= EMBED_MAX_RETRIES:
+                raise
+            time.sleep(_retry_delay(attempt, e))
+            attempt += 1
+    data = sorted(resp.data, key=lambda d: d.index)
+    return [np.array(d.embedding, dtype=np.float32) for d in data]
+
+
+def _embed_uncached(client: OpenAI, texts: List[str], model: str, dimensions: int = 0) -> List[np.ndarray]:
+    batches = _token_batches(texts, model)
+    workers = max(1, min(EMBED_CONCURRENCY, len(batches)))
+    out: List[Optional[np.ndarray]] = [None] * len(texts)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            (b, pool.submit(_embed_batch, client, [texts[i] for i in b], model, dimensions)) for b in batches
+        ]
+        for b, fut in futures:
+            for i, vec in zip(b, fut.result()):
+                out[i] = vec
+    return out  # type: ignore[return-value]
+
+
+def embed_texts(texts: List[str], model: str = EMBED_MODEL, dimensions: int = EMBED_DIMENSIONS) -> np.ndarray:
+    # Cached per text by content hash, model and dimensions
+    cache = get_embed_cache()
+    dim = embedding_dimension(model, dimensions)
+    cache_model = _cache_model(model, dimensions)
+    keys = [compute_sha256_bytes(t.encode("utf-8")) for t in texts]
+    found = cache.get_many(cache_model, keys, dim=dim)
+
+    missing: Dict[str, str] = {}
+    for key, t in zip(keys, texts):
+        if key not in found:
+            missing.setdefault(key, t)
+    if missing:
+        client = get_openai_client()
+        new_vecs = _embed_uncached(client, list(missing.values()), model, dimensions)
+        if dimensions > 0:
+            # Also covers endpoints that ignore the dimensions parameter
+            new_vecs = list(truncate_dimensions(np.vstack(new_vecs), dim))
+        fresh = list(zip(missing.keys(), new_vecs))
+        cache.put_many(cache_model, fresh)
+        found.update(fresh)
 
     # Order results to original order
-    for i in range(len(texts)):
-        vectors.append(cached[i])
-    return np.vstack(vectors)
+    return np.vstack([found[key] for key in keys])
+
+
+_query_cache: "OrderedDict[Tuple[str, int, str], np.ndarray]" = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+
+def embed_query(query: str, model: str = EMBED_MODEL) -> np.ndarray:
+    return embed_queries([query], model)
+
+
+def embed_queries(queries: List[str], model: str = EMBED_MODEL) -> np.ndarray:
+    # In-process LRU of normalized query text -> unit-length (1, dim) vector,
+    # in front of the disk cache; misses are embedded in one batched call.
+    # Returns (len(queries), dim); single-query rows are shared and read-only.
+    texts = [normalize_whitespace(q) for q in queries]
+    keys = [(model, EMBED_DIMENSIONS, t) for t in texts]
+    found: Dict[Tuple[str, int, str], np.ndarray] = {}
+    with _query_cache_lock:
+        for key in keys:
+            vec = _query_cache.get(key)
+            if vec is not None:
+                _query_cache.move_to_end(key)
+                found[key] = vec
+    missing = list(dict.fromkeys(key for key in keys if key not in found))
+    hits = sum(1 for key in keys if key in found)
+    if hits:
+        metrics.incr("query_cache.hits", hits)
+    if missing:
+        metrics.incr("query_cache.misses", len(missing))
+        vecs = embed_texts([key[2] for key in missing], model).astype(np.float32)
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True) + 1e-12
+        for key, vec in zip(missing, vecs):
+            vec = np.array(vec[None, :])
+            vec.setflags(write=False)
+            found[key] = vec
+        if QUERY_CACHE_SIZE > 0:
+            with _query_cache_lock:
+                for key in missing:
+                    _query_cache[key] = found[key]
+                    _query_cache.move_to_end(key)
+                while len(_query_cache) > QUERY_CACHE_SIZE:
+                    _query_cache.popitem(last=False)
+    if len(keys) == 1:
+        return found[keys[0]]
+    return np.vstack([found[key] for key in keys])
+
+
+def query_cache_size() -> int:
+    with _query_cache_lock:
+        return len(_query_cache)
+
+
+def clear_query_cache() -> None:
+    with _query_cache_lock:
+        _query_cache.clear()
+
+
+# Manifest marker for indexes whose FAISS ids are chunks.vector_id rather
+# than row positions. Indexes without it predate stable ids.
+ID_SCHEME = "vector_id"
+
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+
+def _ivf_nlist(n: int) -> int:
+    if IVF_NLIST > 0:
+        return IVF_NLIST
+    return max(1, int(4 * np.sqrt(n)))
+
 
+def _pq_m(dim: int) -> int:
+    # PQ needs a sub-quantizer count that divides the dimension
+    m = max(1, min(PQ_M, dim))
+    while dim % m:
+        m -= 1
+    return m
 
-def build_faiss_index(vectors: np.ndarray):
-    # Normalize for cosine similarity via inner product
+
+# FAISS codec per EMBED_PRECISION; IVF-PQ has its own compression
+_CODECS = {"float32": "Flat", "float16": "SQfp16", "int8": "SQ8"}
+# Vectors converted to float32 and added per batch, so a reduced-precision
+# store is never expanded to float32 whole
+_ADD_BATCH = 65536
+
+
+def _factory_string(index_type: str, n: int, dim: int, precision: str = EMBED_PRECISION) -> str:
+    # IVF variants need enough vectors to train their centroids, so small
+    # corpora fall back to a flat index.
+    if precision not in _CODECS:
+        raise ValueError(f"Unknown EMBED_PRECISION: {precision} (expected one of {', '.join(_CODECS)})")
+    codec = _CODECS[precision]
+    if index_type == "ivf_flat":
+        nlist = _ivf_nlist(n)
+        if n >= nlist * 39:
+            return f"IVF{nlist},{codec}"
+    elif index_type == "ivf_pq":
+        nlist = _ivf_nlist(n)
+        if n >= max(nlist * 39, 2 ** PQ_NBITS * 39):
+            return f"IVF{nlist},PQ{_pq_m(dim)}x{PQ_NBITS}"
+    elif index_type == "hnsw":
+        return f"IDMap2,HNSW{HNSW_M},Flat" if codec == "Flat" else f"IDMap2,HNSW{HNSW_M}_{codec}"
+    elif index_type != "flat":
+        raise ValueError(f"Unknown INDEX_TYPE: {index_type} (expected one of {', '.join(INDEX_TYPES)})")
+    return f"IDMap2,{codec}"
+
+
+def effective_index_type(index_type: str, n: int, dim: int, precision: str = EMBED_PRECISION) -> str:
+    # The index type a build over n vectors actually produces (IVF falls
+    # back to flat until the corpus is large enough to train)
+    factory = _factory_string(index_type, n, dim, precision)
+    if factory.startswith("IVF"):
+        return index_type
+    return "hnsw" if "HNSW" in factory else "flat"
+
+
+def _unit_float32(vectors: np.ndarray, normalized: bool) -> np.ndarray:
+    # What FAISS takes: unit-length float32. Stored float32 vectors are
+    # unit-length (and read-only) already: callers pass normalized.
+    if vectors.dtype != np.float32:
+        return decode_vectors(vectors)
+    if not normalized:
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def build_faiss_index(
+    vectors: np.ndarray,
+    ids: Optional[np.ndarray] = None,
+    index_type: str = INDEX_TYPE,
+    normalized: bool = False,
+    precision: str = EMBED_PRECISION,
+):
+    # Cosine similarity via inner product on unit vectors. vectors may be in
+    # any stored precision (see vector_store).
     if faiss is None:
         raise RuntimeError("FAISS not available; please install faiss-cpu or use Python < 3.13.")
-    faiss.normalize_L2(vectors)
-    dim = vectors.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(vectors)
+    n, dim = vectors.shape
+    spec = _factory_string(index_type, n, dim, precision)
+    index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+    if "HNSW" in spec:
+        faiss.downcast_index(index.index).hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        sample = vectors
+        if n > INDEX_TRAIN_SAMPLE:
+            rng = np.random.default_rng(0)
+            sample = vectors[np.sort(rng.choice(n, INDEX_TRAIN_SAMPLE, replace=False))]
+        index.train(_unit_float32(sample, normalized))
+    if ids is None:
+        ids = np.arange(n)
+    add_to_index(index, vectors, ids, normalized=normalized)
     return index
 
 
-def save_index(index, meta: Dict[str, str], path: Path = INDEX_PATH) -> None:
+def describe_index(index) -> Dict[str, str]:
+    # Manifest fields describing how the index was built
+    if faiss is None:
+        raise RuntimeError("FAISS not available")
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except Exception:  # noqa: BLE001
+        ivf = None
+    if ivf is not None:
+        ivf = faiss.downcast_index(ivf)
+        pq = isinstance(ivf, faiss.IndexIVFPQ)
+        info = {"index_type": "ivf_pq" if pq else "ivf_flat", "nlist": str(ivf.nlist)}
+        if pq:
+            info["pq_m"] = str(ivf.pq.M)
+        else:
+            info["precision"] = _sq_precision(ivf)
+        return info
+    inner = faiss.downcast_index(index.index) if hasattr(index, "index") else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return {
+            "index_type": "hnsw",
+            "hnsw_m": str(inner.hnsw.nb_neighbors(1)),
+            "precision": _sq_precision(faiss.downcast_index(inner.storage)),
+        }
+    return {"index_type": "flat", "precision": _sq_precision(inner)}
+
+
+def _sq_precision(index) -> str:
+    sq = getattr(index, "sq", None)
+    if sq is None:
+        return "float32"
+    return "float16" if sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "int8"
+
+
+def search_params(meta: Dict[str, str], nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    # Per-query search knobs; passed to index.search() so concurrent queries
+    # never mutate shared index state.
+    if faiss is None:
+        return None
+    index_type = meta.get("index_type", "flat")
+    if index_type in ("ivf_flat", "ivf_pq"):
+        return faiss.SearchParametersIVF(nprobe=int(nprobe or NPROBE))
+    if index_type == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search or EF_SEARCH))
+    return None
+
+
+def supports_remove(meta: Dict[str, str]) -> bool:
+    return meta.get("index_type", "flat") != "hnsw"
+
+
+def clone_index(index):
+    if faiss is None:
+        raise RuntimeError("FAISS not available")
+    return faiss.clone_index(index)
+
+
+def add_to_index(index, vectors: np.ndarray, ids: np.ndarray, normalized: bool = False) -> None:
+    if faiss is None:
+        raise RuntimeError("FAISS not available")
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    for start in range(0, vectors.shape[0], _ADD_BATCH):
+        end = start + _ADD_BATCH
+        index.add_with_ids(_unit_float32(vectors[start:end], normalized), ids[start:end])
+
+
+def remove_from_index(index, ids: np.ndarray) -> int:
+    if faiss is None:
+        raise RuntimeError("FAISS not available")
+    if len(ids) == 0:
+        return 0
+    return int(index.remove_ids(np.ascontiguousarray(ids, dtype=np.int64)))
+
+
+def read_manifest(path: Path = INDEX_PATH) -> Optional[Dict[str, str]]:
+    manifest_file = path / "manifest.json"
+    if not manifest_file.exists():
+        return None
+    return json.loads(manifest_file.read_text())
+
+
+def save_index(
+    index, meta: Dict[str, str], path: Path = INDEX_PATH, table: Optional[ChunkTable] = None
+) -> Dict[str, str]:
+    # Each save writes a new generation-stamped index file and then atomically
+    # replaces the manifest, so readers never see a half-written index.
     path.mkdir(parents=True, exist_ok=True)
     if faiss is None:
         raise RuntimeError("FAISS not available")
-    faiss.write_index(index, str(path / "index.faiss"))
-    (path / "manifest.json").write_text(json.dumps(meta, indent=2))
+    previous = read_manifest(path) or {}
+    generation = int(previous.get("generation", 0)) + 1
+    index_name = f"index.{generation}.faiss"
+    tmp_index = path / f".{index_name}.{os.getpid()}.tmp"
+    faiss.write_index(index, str(tmp_index))
+    os.replace(tmp_index, path / index_name)
+
+    meta = dict(meta)
+    meta["generation"] = str(generation)
+    meta["index_file"] = index_name
+    if table is not None:
+        chunks_name = f"chunks.{generation}.npz"
+        tmp_chunks = path / f".{chunks_name}.{os.getpid()}.tmp"
+        save_chunk_table(table, tmp_chunks)
+        os.replace(tmp_chunks, path / chunks_name)
+        meta["chunks_file"] = chunks_name
+    tmp_manifest = path / f".manifest.json.{os.getpid()}.tmp"
+    tmp_manifest.write_text(json.dumps(meta, indent=2))
+    os.replace(tmp_manifest, path / "manifest.json")
+
+    # Keep the previous generation around for readers that are mid-load
+    keep = {
+        index_name,
+        meta.get("chunks_file", ""),
+        previous.get("index_file", ""),
+        previous.get("chunks_file", ""),
+    }
+    for pattern in ("index.*.faiss", "chunks.*.npz"):
+        for old in path.glob(pattern):
+            if old.name not in keep:
+                old.unlink(missing_ok=True)
+    return meta
 
 
 def load_index(path: Path = INDEX_PATH) -> Tuple[Optional[object], Optional[Dict[str, str]]]:
-    index_file = path / "index.faiss"
-    manifest_file = path / "manifest.json"
-    if not index_file.exists() or not manifest_file.exists():
-        return None, None
     if faiss is None:
         return None, None
+    meta = read_manifest(path)
+    if meta is None:
+        return None, None
+    index_file = path / meta.get("index_file", "index.faiss")
+    if not index_file.exists():
+        return None, None
     index = faiss.read_index(str(index_file))
-    meta = json.loads(manifest_file.read_text())
     return index, meta
-
@@ -1,10 +1,16 @@
+import asyncio
+import weakref
 from dataclasses import asdict, dataclass
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, Iterator, List, NamedTuple, Optional, Tuple
 
-from openai import OpenAI
-
-from .config import CONFIDENCE_THRESHOLD, GENERATE_MODEL, OPENAI_API_KEY
+from . import metrics
+from .clients import get_async_client, get_client
+from .config import CHUNK_OVERLAP, CONFIDENCE_THRESHOLD, CONTEXT_MAX_TOKENS, GENERATE_MODEL, LLM_CONCURRENCY
 from .prompts import SYSTEM_PROMPT_STRICT
+from .utils import count_tokens, normalize_whitespace, truncate_tokens
+
+# The "\n\n" between context blocks
+_SEPARATOR_TOKENS = 1
 
 
 @dataclass
@@ -12,6 +18,17 @@ class Citation:
     filename: str
     chunk_id: int
     page: Optional[int]
+    # Set when adjacent chunks chunk_id..last_chunk_id were merged into one block
+    last_chunk_id: Optional[int] = None
+
+    @property
+    def tag(self) -> str:
+        tag = f"{self.filename}#{self.chunk_id}"
+        if self.last_chunk_id is not None:
+            tag += f"-{self.last_chunk_id}"
+        if self.page:
+            tag += f" (p. {self.page})"
+        return tag
 
 
 @dataclass
@@ -20,14 +37,102 @@ class GenerateResult:
     citations: List[Citation]
 
 
-def _format_context(chunks: List[Dict]) -> str:
+class PackedContext(NamedTuple):
+    text: str
+    # citations[i] is the evidence numbered [i + 1] in text
+    citations: List[Citation]
+    tokens: int
+
+
+@dataclass
+class _Block:
+    document_id: str
+    filename: str
+    page: Optional[int]
+    first: int
+    last: int
+    text: str
+    rank: int
+
+
+def _overlap(a: str, b: str, max_len: int = CHUNK_OVERLAP) -> int:
+    # Length of the longest suffix of a that is also a prefix of b, up to
+    # the CHUNK_OVERLAP characters chunk_text repeats between neighbours;
+    # searching further would eat real content in repetitive text
+    for n in range(min(len(a), len(b), max_len), 0, -1):
+        if a.endswith(b[:n]):
+            return n
+    return 0
+
+
+def _merge_runs(chunks: List[Dict]) -> List[_Block]:
+    # Chunks with consecutive chunk_ids from the same document and page are
+    # neighbours from chunk_text; join each run and drop the overlapping span
+    # they share. Blocks keep the rank of their best-ranked chunk.
+    by_key: Dict[Tuple[str, Optional[int]], Dict[int, Tuple[int, Dict]]] = {}
+    for rank, ch in enumerate(chunks):
+        key = (ch.get("document_id") or ch["filename"], ch.get("page"))
+        by_key.setdefault(key, {}).setdefault(int(ch["chunk_id"]), (rank, ch))
+    blocks: List[_Block] = []
+    for members in by_key.values():
+        block: Optional[_Block] = None
+        for cid in sorted(members):
+            rank, ch = members[cid]
+            if block is not None and cid == block.last + 1:
+                block.text += ch["text"][_overlap(block.text, ch["text"]):]
+                block.last = cid
+                block.rank = min(block.rank, rank)
+                continue
+            block = _Block(
+                document_id=ch.get("document_id") or ch["filename"],
+                filename=ch["filename"],
+                page=ch.get("page"),
+                first=cid,
+                last=cid,
+                text=ch["text"],
+                rank=rank,
+            )
+            blocks.append(block)
+    blocks.sort(key=lambda b: b.rank)
+    # Drop blocks whose text already appears inside a better-ranked block
+    # (e.g. the same passage in two uploads)
+    kept: List[_Block] = []
+    for b in blocks:
+        needle = normalize_whitespace(b.text)
+        if any(needle in normalize_whitespace(k.text) for k in kept):
+            continue
+        kept.append(b)
+    return kept
+
+
+def pack_context(chunks: List[Dict], max_tokens: int = CONTEXT_MAX_TOKENS) -> PackedContext:
+    # Number merged blocks in rank order and add them while they fit in
+    # max_tokens (0 = no limit). Blocks that don't fit are skipped so smaller,
+    # lower-ranked ones can still use the room; the top block is truncated
+    # rather than dropped.
     lines: List[str] = []
-    for i, ch in enumerate(chunks, start=1):
-        tag = f"{ch['filename']}#{ch['chunk_id']}"
-        if ch.get("page"):
-            tag += f" (p. {ch['page']})"
-        lines.append(f"[{i}] {tag}:\n{ch['text']}")
-    return "\n\n".join(lines)
+    citations: List[Citation] = []
+    used = 0
+    for b in _merge_runs(chunks):
+        citation = Citation(
+            filename=b.filename,
+            chunk_id=b.first,
+            page=b.page,
+            last_chunk_id=b.last if b.last != b.first else None,
+        )
+        header = f"[{len(citations) + 1}] {citation.tag}:\n"
+        cost = count_tokens(header + b.text, GENERATE_MODEL) + _SEPARATOR_TOKENS
+        text = b.text
+        if max_tokens > 0 and used + cost > max_tokens:
+            if citations:
+                continue
+            room = max_tokens - count_tokens(header, GENERATE_MODEL) - _SEPARATOR_TOKENS
+            text = truncate_tokens(b.text, GENERATE_MODEL, room)
+            cost = max_tokens
+        lines.append(header + text)
+        citations.append(citation)
+        used += cost
+    return PackedContext(text="\n\n".join(lines), citations=citations, tokens=used)
 
 
 def _should_say_idk(retrieved: List[Dict]) -> bool:
@@ -37,40 +142,111 @@ def _should_say_idk(retrieved: List[Dict]) -> bool:
     return top_score < CONFIDENCE_THRESHOLD
 
 
-def generate_answer(query: str, retrieved: List[Dict]) -> GenerateResult:
-    if _should_say_idk(retrieved):
-        return GenerateResult(
-            answer="I don't know. The retrieved context is insufficient or too low-confidence to answer.",
-            citations=[],
-        )
+def _idk_result() -> GenerateResult:
+    return GenerateResult(
+        answer="I don't know. The retrieved context is insufficient or too low-confidence to answer.",
+        citations=[],
+    )
 
-    client = OpenAI(api_key=OPENAI_API_KEY)
 
-    context = _format_context(retrieved)
+def _build_messages(query: str, context: str) -> List[Dict[str, str]]:
     user_prompt = (
         "Answer the user's question using ONLY the context. "
         "Cite the evidence numerically like [1], [2] where appropriate.\n\n"
         f"Question: {query}\n\nContext:\n{context}"
     )
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT_STRICT},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def citations_for(retrieved: List[Dict]) -> List[Citation]:
+    # The citations generate_answer would return, known before generation starts
+    return [] if _should_say_idk(retrieved) else pack_context(retrieved).citations
+
 
-    resp = client.chat.completions.create(
+def generate_answer(query: str, retrieved: List[Dict]) -> GenerateResult:
+    if _should_say_idk(retrieved):
+        return _idk_result()
+
+    with metrics.timer("generate.pack"):
+        packed = pack_context(retrieved)
+    client = get_client()
+    with metrics.timer("generate.llm"):
+        resp = client.chat.completions.create(
+            model=GENERATE_MODEL,
+            messages=_build_messages(query, packed.text),
+            temperature=0.1,
+        )
+    answer = resp.choices[0].message.content.strip()
+    return GenerateResult(answer=answer, citations=packed.citations)
+
+
+def stream_answer(query: str, retrieved: List[Dict]) -> Iterator[str]:
+    # Yield answer text as the model produces it; citations come from
+    # the packed context and do not depend on the answer, see citations_for
+    if _should_say_idk(retrieved):
+        yield _idk_result().answer
+        return
+
+    client = get_client()
+    stream = client.chat.completions.create(
         model=GENERATE_MODEL,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT_STRICT},
-            {"role": "user", "content": user_prompt},
-        ],
+        messages=_build_messages(query, pack_context(retrieved).text),
         temperature=0.1,
+        stream=True,
     )
-    answer = resp.choices[0].message.content.strip()
+    with stream:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+# Created lazily per event loop: asyncio primitives are bound to the loop they are used on
+_llm_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _llm_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    sem = _llm_semaphores.get(loop)
+    if sem is None:
+        sem = asyncio.Semaphore(max(1, LLM_CONCURRENCY))
+        _llm_semaphores[loop] = sem
+    return sem
 
-    citations: List[Citation] = []
-    seen = set()
-    for ch in retrieved:
-        key = (ch["filename"], ch["chunk_id"], ch.get("page"))
-        if key in seen:
-            continue
-        seen.add(key)
-        citations.append(Citation(filename=ch["filename"], chunk_id=ch["chunk_id"], page=ch.get("page")))
 
-    return GenerateResult(answer=answer, citations=citations)
+async def agenerate_answer(query: str, retrieved: List[Dict]) -> GenerateResult:
+    # Async variant for the web app; at most LLM_CONCURRENCY chat calls in flight
+    if _should_say_idk(retrieved):
+        return _idk_result()
+
+    with metrics.timer("generate.pack"):
+        packed = pack_context(retrieved)
+    async with _llm_semaphore():
+        with metrics.timer("generate.llm"):
+            resp = await get_async_client().chat.completions.create(
+                model=GENERATE_MODEL,
+                messages=_build_messages(query, packed.text),
+                temperature=0.1,
+            )
+    answer = resp.choices[0].message.content.strip()
+    return GenerateResult(answer=answer, citations=packed.citations)
+
 
+async def astream_answer(query: str, retrieved: List[Dict]) -> AsyncIterator[str]:
+    if _should_say_idk(retrieved):
+        yield _idk_result().answer
+        return
+
+    async with _llm_semaphore():
+        stream = await get_async_client().chat.completions.create(
+            model=GENERATE_MODEL,
+            messages=_build_messages(query, pack_context(retrieved).text),
+            temperature=0.1,
+            stream=True,
+        )
+        async with stream:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
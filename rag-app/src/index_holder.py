@@ -0,0 +1,117 @@
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from . import db
+from .chunk_store import ChunkTable, load_chunk_table
+from .config import INDEX_PATH
+from .embed_index import ID_SCHEME, load_index, manifest_mismatch
+
+
+class IndexMismatch(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class LoadedIndex:
+    index: Any
+    meta: Dict[str, str]
+    generation: int
+    table: ChunkTable
+
+
+# Process-resident index, reloaded when manifest.json changes on disk.
+# A reload only swaps the reference, so in-flight queries keep searching
+# the LoadedIndex they already grabbed.
+class IndexHolder:
+    def __init__(self, path: Path = INDEX_PATH) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        self._current: Optional[LoadedIndex] = None
+        self._stamp: Optional[Tuple[int, int, int]] = None
+        # Why the index on disk was rejected for this process's settings;
+        # kept until the manifest changes
+        self._mismatch: Optional[str] = None
+
+    def _manifest_stamp(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self._path / "manifest.json")
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def get(self) -> Optional[LoadedIndex]:
+        stamp = self._manifest_stamp()
+        current = self._current
+        if stamp is not None and stamp == self._stamp:
+            return current
+        with self._lock:
+            if stamp is not None and stamp == self._stamp:
+                return self._current
+            if stamp is None:
+                self._current = None
+                self._stamp = None
+                return None
+            try:
+                index, meta = load_index(self._path)
+            except Exception:  # noqa: BLE001
+                # Writer may have pruned the file we were pointed at; keep
+                # serving the old index and retry on the next call.
+                return self._current
+            if index is None or meta is None:
+                return self._current
+            mismatch = manifest_mismatch(meta)
+            if meta.get("ids") != ID_SCHEME or mismatch is not None:
+                # Positional index from before stable ids, or built for another
+                # model/EMBED_DIMENSIONS than queries are embedded with;
+                # unusable until rebuilt
+                self._current = None
+                self._stamp = stamp
+                self._mismatch = mismatch
+                return None
+            table = self._load_table(meta)
+            self._mismatch = None
+            self._current = LoadedIndex(
+                index=index, meta=meta, generation=int(meta.get("generation", 0)), table=table
+            )
+            self._stamp = stamp
+            return self._current
+
+    def check(self) -> Optional[LoadedIndex]:
+        # get(), but raises IndexMismatch instead of returning None when the
+        # index on disk doesn't fit the current embedding settings
+        loaded = self.get()
+        if loaded is None and self._mismatch is not None:
+            raise IndexMismatch(self._mismatch)
+        return loaded
+
+    def _load_table(self, meta: Dict[str, str]) -> ChunkTable:
+        table = None
+        if meta.get("chunks_file"):
+            table = load_chunk_table(self._path / meta["chunks_file"])
+        if table is None:
+            # Manifest without a chunk table: rebuild the mapping from SQLite
+            filenames = {d["id"]: d["filename"] for d in db.list_documents()}
+            table = ChunkTable.from_rows(db.chunk_metadata(), filenames)
+        return table
+
+    def install(self, index, meta: Dict[str, str], table: ChunkTable) -> LoadedIndex:
+        # Used by in-process writers right after save_index() so the freshly
+        # built index is served without reading it back from disk.
+        loaded = LoadedIndex(index=index, meta=meta, generation=int(meta.get("generation", 0)), table=table)
+        with self._lock:
+            self._current = loaded
+            self._stamp = self._manifest_stamp()
+            self._mismatch = None
+        return loaded
+
+    def clear(self) -> None:
+        with self._lock:
+            self._current = None
+            self._stamp = None
+            self._mismatch = None
+
+
+index_holder = IndexHolder()
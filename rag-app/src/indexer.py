@@ -0,0 +1,153 @@
+import threading
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List
+
+import numpy as np
+
+from . import db
+from .chunk_store import ChunkTable
+from .config import EMBED_DIMENSIONS, EMBED_MODEL, EMBED_PRECISION, INDEX_PATH, INDEX_RETRAIN_GROWTH, INDEX_TYPE
+from .embed_index import (
+    ID_SCHEME,
+    add_to_index,
+    build_faiss_index,
+    clone_index,
+    describe_index,
+    effective_index_type,
+    expected_dimension,
+    manifest_matches,
+    read_manifest,
+    remove_from_index,
+    save_index,
+    supports_remove,
+)
+from .index_holder import index_holder
+from .vector_store import get_vector_store
+
+try:
+    import fcntl  # type: ignore
+except ImportError:  # Windows: writers are only serialized within the process
+    fcntl = None  # type: ignore
+
+
+# Serializes index writers (worker jobs, /reindex) within the process
+_write_lock = threading.Lock()
+
+
+@contextmanager
+def _writer_lock() -> Iterator[None]:
+    # Other processes (a CLI worker next to the web app) write the index too.
+    # The flock is held from reading the manifest to replacing it, so two
+    # writers never pick the same generation.
+    with _write_lock:
+        if fcntl is None:
+            yield
+            return
+        INDEX_PATH.mkdir(parents=True, exist_ok=True)
+        with open(INDEX_PATH / ".write.lock", "a+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+
+def rebuild_index() -> int:
+    with _writer_lock():
+        return _rebuild_index()
+
+
+def _rebuild_index() -> int:
+    rows = db.all_chunks_with_embeddings()
+    if not rows:
+        return 0
+    # Rows come in vec_row order; a float32 store without gaps is handed to
+    # FAISS as a view of the memory-mapped file
+    vectors = get_vector_store().take(np.array([r["vec_row"] for r in rows], dtype=np.int64))
+    dim = expected_dimension()
+    if dim is not None and vectors.shape[1] != dim:
+        # Queries would be embedded at another size than the stored vectors
+        hint = "run `migrate-dimensions`" if vectors.shape[1] > dim else "ingest into new DB_PATH/INDEX_PATH/VECTORS_PATH"
+        raise ValueError(
+            f"Stored embeddings have {vectors.shape[1]} dimensions but {EMBED_MODEL} "
+            f"with EMBED_DIMENSIONS={EMBED_DIMENSIONS} gives {dim}; {hint}"
+        )
+    ids = np.array([r["vector_id"] for r in rows], dtype=np.int64)
+    index = build_faiss_index(vectors, ids, normalized=True)
+    filenames = {d["id"]: d["filename"] for d in db.list_documents()}
+    table = ChunkTable.from_rows(rows, filenames)
+    meta = {
+        "model": EMBED_MODEL,
+        "dim": str(vectors.shape[1]),
+        "ids": ID_SCHEME,
+        "configured_index_type": INDEX_TYPE,
+    }
+    # index_type is what was built, e.g. flat while the corpus is too small for IVF
+    meta.update(describe_index(index))
+    if meta["index_type"] in ("ivf_flat", "ivf_pq"):
+        meta["trained_on"] = str(len(rows))
+    meta = save_index(index, meta, table=table)
+    index_holder.install(index, meta, table)
+    return len(rows)
+
+
+def update_index(doc_ids: Iterable[str]) -> int:
+    # Re-sync only the given documents: drop whatever vectors the index holds
+    # for them (and for documents no longer in the DB), then append their
+    # current embeddings. Falls back to a full rebuild when there is no
+    # usable index to patch.
+    with _writer_lock():
+        return _update_index(list(dict.fromkeys(doc_ids)))
+
+
+def _update_index(doc_ids: List[str]) -> int:
+    # Under the flock, so this picks up a generation another process saved
+    loaded = index_holder.get()
+    if loaded is None or not manifest_matches(loaded.meta):
+        return _rebuild_index()
+    if loaded.meta.get("index_type", "flat") != "ivf_pq" and loaded.meta.get("precision", "float32") != EMBED_PRECISION:
+        return _rebuild_index()
+
+    rows = db.chunks_with_embeddings_for_documents(doc_ids)
+    vectors = None
+    if rows:
+        vectors = get_vector_store().take(np.array([r["vec_row"] for r in rows], dtype=np.int64))
+        if vectors.shape[1] != int(loaded.meta.get("dim", 0)):
+            return _rebuild_index()
+
+    filenames = {d["id"]: d["filename"] for d in db.list_documents()}
+    deleted = [str(d) for d in loaded.table.doc_ids if str(d) not in filenames]
+    stale = doc_ids + deleted
+    stale_ids = loaded.table.vector_ids_for_documents(stale)
+    if not rows and not stale_ids.size:
+        return 0
+    # Compare with the type a rebuild would choose at the new size, not
+    # INDEX_TYPE itself: IVF stays flat (and patchable) until the corpus is
+    # large enough to train it, then the next job rebuilds
+    n = loaded.index.ntotal - int(stale_ids.size) + len(rows)
+    target = effective_index_type(INDEX_TYPE, n, int(loaded.meta.get("dim", 0)))
+    if loaded.meta.get("index_type", "flat") != target:
+        return _rebuild_index()
+    if stale_ids.size and not supports_remove(loaded.meta):
+        return _rebuild_index()
+    trained_on = int(loaded.meta.get("trained_on", 0))
+    if trained_on and loaded.index.ntotal + len(rows) > trained_on * INDEX_RETRAIN_GROWTH:
+        # IVF centroids were trained on a much smaller corpus; compact/retrain
+        return _rebuild_index()
+
+    # Copy-on-write so queries in flight keep searching the old index
+    index = clone_index(loaded.index)
+    remove_from_index(index, stale_ids)
+    table = loaded.table.without_documents(stale)
+    if rows:
+        add_to_index(index, vectors, np.array([r["vector_id"] for r in rows], dtype=np.int64), normalized=True)
+        table = table.concat(ChunkTable.from_rows(rows, filenames))
+
+    meta = dict(loaded.meta, configured_index_type=INDEX_TYPE)
+    meta = save_index(index, meta, table=table)
+    index_holder.install(index, meta, table)
+    return len(rows)
+
+
+def index_needs_rebuild() -> bool:
+    meta = read_manifest()
+    # Only the one-off migration from positional ids is rebuilt on the query
+    # path; a model/dimension mismatch needs reindex or migrate-dimensions
+    return meta is not None and meta.get("ids") != ID_SCHEME and manifest_matches(meta)
@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator
+
+import numpy as np
+
+# Process-wide counters and latency samples, exposed on GET /metrics.
+_lock = threading.Lock()
+_counters: Dict[str, int] = defaultdict(int)
+# Most recent samples per timer, enough for stable p95/p99 without growing
+_TIMER_WINDOW = 2048
+_timings: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=_TIMER_WINDOW))
+
+
+def incr(name: str, n: int = 1) -> None:
+    with _lock:
+        _counters[name] += n
+
+
+def observe(name: str, ms: float) -> None:
+    with _lock:
+        _timings[name].append(ms)
+        _counters[f"{name}.count"] += 1
+
+
+@contextmanager
+def timer(name: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, (time.perf_counter() - t0) * 1000.0)
+
+
+def snapshot() -> Dict[str, int]:
+    with _lock:
+        return dict(_counters)
+
+
+def timings() -> Dict[str, Dict[str, float]]:
+    with _lock:
+        samples = {name: np.array(values) for name, values in _timings.items() if values}
+    return {
+        name: {
+            "p50_ms": float(np.percentile(v, 50)),
+            "p95_ms": float(np.percentile(v, 95)),
+            "p99_ms": float(np.percentile(v, 99)),
+            "samples": int(v.size),
+        }
+        for name, v in samples.items()
+    }
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _timings.clear()
@@ -0,0 +1,144 @@
+import re
+import threading
+import time
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+
+from . import metrics
+from .config import (
+    CROSS_ENCODER_MODEL,
+    MMR_LAMBDA,
+    RERANK_BATCH_SIZE,
+    RERANK_BUDGET_MS,
+    RERANK_LEXICAL_WEIGHT,
+)
+
+try:
+    from sentence_transformers import CrossEncoder  # type: ignore
+except Exception:
+    CrossEncoder = None  # type: ignore
+
+
+# Second-stage rerankers over the first-stage candidates. Each returns the
+# candidate positions in their new order. A reranker that runs past its
+# deadline raises BudgetExceeded and rerank() keeps the first-stage order.
+RERANKERS = ("none", "lexical", "mmr", "cross_encoder")
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def _check(deadline: float) -> None:
+    if time.perf_counter() > deadline:
+        raise BudgetExceeded()
+
+
+def _tokens(text: str) -> List[str]:
+    return [t.lower() for t in _TOKEN_RE.findall(text)]
+
+
+def _lexical_order(query: str, texts: Sequence[str], scores: Sequence[float], deadline: float) -> List[int]:
+    # Blend the first-stage cosine with the share of the query's idf mass
+    # (idf over the candidate set) that each candidate contains
+    terms = set(_tokens(query))
+    if not terms:
+        return list(range(len(texts)))
+    doc_terms = []
+    for start in range(0, len(texts), RERANK_BATCH_SIZE):
+        _check(deadline)
+        doc_terms.extend(set(_tokens(t)) & terms for t in texts[start:start + RERANK_BATCH_SIZE])
+    n = len(texts)
+    idf = {t: float(np.log(1.0 + n / (1.0 + sum(t in d for d in doc_terms)))) for t in terms}
+    total = sum(idf.values()) or 1.0
+    blended = [
+        (1.0 - RERANK_LEXICAL_WEIGHT) * s + RERANK_LEXICAL_WEIGHT * sum(idf[t] for t in d) / total
+        for s, d in zip(scores, doc_terms)
+    ]
+    return sorted(range(n), key=lambda i: blended[i], reverse=True)
+
+
+def _mmr_order(q_vec: np.ndarray, vectors: np.ndarray, k: int, deadline: float) -> List[int]:
+    # Maximal marginal relevance: greedily trade relevance for novelty
+    # against what is already picked; only the first k positions matter
+    n = vectors.shape[0]
+    relevance = vectors @ q_vec
+    pairwise = vectors @ vectors.T
+    picked: List[int] = []
+    redundancy = np.full(n, -np.inf, dtype=np.float32)
+    remaining = np.ones(n, dtype=bool)
+    for _ in range(min(k, n)):
+        _check(deadline)
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+        mmr = MMR_LAMBDA * relevance - (1.0 - MMR_LAMBDA) * penalty
+        mmr[~remaining] = -np.inf
+        best = int(np.argmax(mmr))
+        picked.append(best)
+        remaining[best] = False
+        redundancy = np.maximum(redundancy, pairwise[best])
+    rest = [i for i in np.argsort(-relevance) if remaining[i]]
+    return picked + [int(i) for i in rest]
+
+
+_cross_encoder: Optional[Any] = None
+_cross_encoder_lock = threading.Lock()
+
+
+def get_cross_encoder() -> Optional[Any]:
+    # Loaded once per process; None when sentence-transformers isn't installed
+    global _cross_encoder
+    if CrossEncoder is None:
+        return None
+    if _cross_encoder is None:
+        with _cross_encoder_lock:
+            if _cross_encoder is None:
+                _cross_encoder = CrossEncoder(CROSS_ENCODER_MODEL, device="cpu")
+    return _cross_encoder
+
+
+def _cross_encoder_order(model: Any, query: str, texts: Sequence[str], deadline: float) -> List[int]:
+    scores: List[float] = []
+    for start in range(0, len(texts), RERANK_BATCH_SIZE):
+        _check(deadline)
+        pairs = [(query, t) for t in texts[start:start + RERANK_BATCH_SIZE]]
+        scores.extend(float(s) for s in model.predict(pairs, batch_size=RERANK_BATCH_SIZE, show_progress_bar=False))
+    _check(deadline)
+    return sorted(range(len(texts)), key=lambda i: scores[i], reverse=True)
+
+
+def rerank(
+    query: str,
+    q_vec: np.ndarray,
+    texts: Sequence[str],
+    scores: Sequence[float],
+    vectors: Optional[np.ndarray],
+    k: int,
+    reranker: str,
+    budget_ms: float = RERANK_BUDGET_MS,
+) -> List[int]:
+    # Candidates arrive in first-stage order, which is also the fallback
+    if reranker not in RERANKERS:
+        raise ValueError(f"Unknown reranker: {reranker}")
+    first_stage = list(range(len(texts)))
+    if reranker == "none" or len(texts) <= 1:
+        return first_stage
+    model = None
+    if reranker == "cross_encoder":
+        # Model load is a one-off and isn't charged to the query's budget
+        model = get_cross_encoder()
+        if model is None:
+            metrics.incr("rerank.unavailable")
+            return first_stage
+    deadline = time.perf_counter() + budget_ms / 1000.0
+    try:
+        if reranker == "lexical":
+            return _lexical_order(query, texts, scores, deadline)
+        if reranker == "mmr":
+            return _mmr_order(q_vec, vectors, k, deadline)
+        return _cross_encoder_order(model, query, texts, deadline)
+    except BudgetExceeded:
+        metrics.incr("rerank.over_budget")
+        return first_stage
@@ -7,9 +7,16 @@ except Exception:
     faiss = None  # type: ignore
 import numpy as np
 
-from . import db
-from .config import EMBED_MODEL, K, RERANK_TOP_M
-from .embed_index import embed_texts, load_index
+from . import db, metrics
+from .config import EMBED_MODEL, K, RERANK_TOP_M, RERANKER, RETRIEVAL_MODE, RRF_K
+from .embed_index import embed_queries, search_params
+from .index_holder import LoadedIndex, index_holder
+from .indexer import index_needs_rebuild, rebuild_index
+from .rerank import RERANKERS, rerank
+from .vector_store import decode_vectors, get_vector_store
+
+
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
 
 
 @dataclass
@@ -20,55 +27,182 @@ class RetrievedChunk:
     page: Optional[int]
     text: str
     score: float
+    vector_id: Optional[int] = None
+
+
+def _load_index_or_build() -> Optional[LoadedIndex]:
+    # Raises IndexMismatch when the index was built for other embedding settings
+    loaded = index_holder.check()
+    if loaded is None and index_needs_rebuild():
+        rebuild_index()
+        loaded = index_holder.get()
+    return loaded
+
+
+def _dense_hits(
+    loaded: LoadedIndex, q_vecs: np.ndarray, m: int, nprobe: Optional[int], ef_search: Optional[int]
+) -> List[List[Tuple[int, float]]]:
+    # Per query row, (vector_id, cosine) best first; already cosine via
+    # normalized IP. One search call for the whole query matrix.
+    params = search_params(loaded.meta, nprobe=nprobe, ef_search=ef_search)
+    D, I = loaded.index.search(q_vecs, m, params=params)
+    out = []
+    for scores, vids in zip(D, I):
+        hits = [(int(vid), float(score)) for score, vid in zip(scores, vids) if vid >= 0]
+        hits.sort(key=lambda x: x[1], reverse=True)
+        out.append(hits)
+    return out
+
+
+def _rrf(rankings: List[List[int]], rrf_k: int = RRF_K) -> List[int]:
+    # Reciprocal rank fusion: sum of 1 / (rrf_k + rank) over the rankings
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, vid in enumerate(ranking, start=1):
+            fused[vid] = fused.get(vid, 0.0) + 1.0 / (rrf_k + rank)
+    return [vid for vid, _ in sorted(fused.items(), key=lambda x: x[1], reverse=True)]
+
+
+def retrieve(
+    query: str,
+    k: int = K,
+    m: int = RERANK_TOP_M,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    mode: str = RETRIEVAL_MODE,
+    reranker: str = RERANKER,
+) -> List[RetrievedChunk]:
+    return retrieve_many([query], k=k, m=m, nprobe=nprobe, ef_search=ef_search, mode=mode, reranker=reranker)[0]
+
+
+def retrieve_many(
+    queries: List[str],
+    k: int = K,
+    m: int = RERANK_TOP_M,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    mode: str = RETRIEVAL_MODE,
+    reranker: str = RERANKER,
+) -> List[List[RetrievedChunk]]:
+    return retrieve_with_vectors(
+        queries, k=k, m=m, nprobe=nprobe, ef_search=ef_search, mode=mode, reranker=reranker
+    )[0]
+
+
+def retrieve_with_vectors(
+    queries: List[str],
+    k: int = K,
+    m: int = RERANK_TOP_M,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    mode: str = RETRIEVAL_MODE,
+    reranker: str = RERANKER,
+) -> Tuple[List[List[RetrievedChunk]], Optional[np.ndarray]]:
+    # Results per query, in order, plus the (len(queries), dim) query
+    # embeddings for callers that need them too (the answer cache); None
+    # when there is no index. Uncached queries are embedded in one request,
+    # the index is searched once with the query matrix, and chunk rows (and
+    # stored vectors, if needed) are read once for all hits.
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+    if reranker not in RERANKERS:
+        raise ValueError(f"Unknown reranker: {reranker}")
+    if not queries:
+        return [], None
+    loaded = _load_index_or_build()
+    if loaded is None:
+        return [[] for _ in queries], None
+
+    n = len(queries)
+    with metrics.timer(f"retrieve.{mode}"):
+        with metrics.timer("retrieve.embed"):
+            # Already unit-length, so no normalize_L2 here
+            q_vecs = embed_queries(queries, EMBED_MODEL)
+        dense: List[List[Tuple[int, float]]] = [[] for _ in range(n)]
+        lexical: List[List[Tuple[int, float]]] = [[] for _ in range(n)]
+        if mode in ("dense", "hybrid"):
+            with metrics.timer("retrieve.dense_search"):
+                dense = _dense_hits(loaded, q_vecs, m, nprobe, ef_search)
+        if mode in ("lexical", "hybrid"):
+            with metrics.timer("retrieve.lexical_search"):
+                lexical = [db.search_chunks_bm25(q, m) for q in queries]
+
+        # FAISS ids are chunks.vector_id; drop ids the chunk table doesn't
+        # know (e.g. lexical hits on chunks not yet in the index)
+        table = loaded.table
+        tops: List[List[Tuple[int, int]]] = []
+        cosines: List[Dict[int, float]] = []
+        for d, lex in zip(dense, lexical):
+            if mode == "dense":
+                ranked = [vid for vid, _ in d]
+            elif mode == "lexical":
+                ranked = [vid for vid, _ in lex]
+            else:
+                ranked = _rrf([[vid for vid, _ in d], [vid for vid, _ in lex]])
+            rows = table.rows_for(np.array(ranked, dtype=np.int64))
+            candidates = [(vid, int(row)) for vid, row in zip(ranked, rows) if row >= 0]
+            # Without a reranker only the final top-k texts are read from
+            # SQLite; a reranker sees every first-stage candidate
+            tops.append(candidates if reranker != "none" else candidates[:k])
+            cosines.append(dict(d))
+
+        with metrics.timer("retrieve.metadata"):
+            wanted = list(dict.fromkeys(vid for top in tops for vid, _ in top))
+            chunks = db.get_chunks_by_vector_ids(wanted)
+            # score stays the query cosine in every mode, so
+            # CONFIDENCE_THRESHOLD still applies; lexical-only hits get it
+            # from their stored embedding, as does MMR
+            need = list(dict.fromkeys(
+                vid
+                for top, cosine in zip(tops, cosines)
+                for vid, _ in top
+                if vid in chunks and (reranker == "mmr" or vid not in cosine)
+            ))
+            vector_pos: Dict[int, int] = {}
+            stored = None
+            if need:
+                # Read in file order: consecutive rows come back as one view
+                need.sort(key=lambda vid: int(chunks[vid]["vec_row"]))
+                vec_rows = np.array([chunks[vid]["vec_row"] for vid in need], dtype=np.int64)
+                stored = decode_vectors(get_vector_store().take(vec_rows))
+                vector_pos = {vid: i for i, vid in enumerate(need)}
 
+        out: List[List[RetrievedChunk]] = []
+        for query, q_vec, top, cosine in zip(queries, q_vecs, tops, cosines):
+            found = [(vid, row, chunks[vid]) for vid, row in top if vid in chunks]
+            vectors = None
+            if stored is not None and found and all(vid in vector_pos for vid, _, _ in found):
+                # Unit-length rows in result order
+                vectors = stored[[vector_pos[vid] for vid, _, _ in found]]
+            results: List[RetrievedChunk] = []
+            for vid, row, r in found:
+                score = cosine.get(vid)
+                if score is None:
+                    score = float(stored[vector_pos[vid]] @ q_vec)
+                results.append(
+                    RetrievedChunk(
+                        document_id=r["document_id"],
+                        filename=table.filename(row),
+                        chunk_id=int(r["chunk_id"]),
+                        page=int(r["page"]) if r["page"] is not None else None,
+                        text=r["text"],
+                        score=float(score),
+                        vector_id=vid,
+                    )
+                )
 
-def _load_index_or_build() -> Tuple[Optional[object], Optional[Dict[str, Any]]]:
-    index, meta = load_index()
-    return index, meta
-
-
-def retrieve(query: str, k: int = K, m: int = RERANK_TOP_M) -> List[RetrievedChunk]:
-    index, meta = _load_index_or_build()
-    if index is None:
-        return []
-
-    q_vec = embed_texts([query], EMBED_MODEL).astype(np.float32)
-    faiss.normalize_L2(q_vec)
-    D, I = index.search(q_vec, m)
-    scores = D[0]
-    indices = I[0]
-    rows = db.all_chunks_with_embeddings()
-    if not rows:
-        return []
-
-    # Map index position to chunk row
-    retrieved: List[Tuple[float, int]] = []
-    for score, idx in zip(scores, indices):
-        if idx < 0 or idx >= len(rows):
-            continue
-        retrieved.append((float(score), idx))
-
-    # Rerank by cosine score (already cosine via normalized IP)
-    retrieved.sort(key=lambda x: x[0], reverse=True)
-    top = retrieved[:k]
-
-    results: List[RetrievedChunk] = []
-    # Preload doc filename map
-    docs = {r["id"]: r for r in db.list_documents()}
-    for score, idx in top:
-        r = rows[idx]
-        doc = docs.get(r["document_id"]) or db.get_document(r["document_id"])  # fallback
-        filename = doc["filename"] if doc else r["document_id"]
-        results.append(
-            RetrievedChunk(
-                document_id=r["document_id"],
-                filename=filename,
-                chunk_id=int(r["chunk_id"]),
-                page=int(r["page"]) if r["page"] is not None else None,
-                text=r["text"],
-                score=float(score),
-            )
-        )
-
-    return results
+            if reranker != "none":
+                with metrics.timer("retrieve.rerank"):
+                    order = rerank(
+                        query,
+                        q_vec,
+                        [c.text for c in results],
+                        [c.score for c in results],
+                        vectors,
+                        k,
+                        reranker,
+                    )
+                results = [results[i] for i in order]
+            out.append(results[:k])
 
+    return out, q_vecs
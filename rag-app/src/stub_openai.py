@@ -0,0 +1,142 @@
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+import re
+import time
+from typing import AsyncIterator, List, Union
+
+import numpy as np
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+from .config import getenv_int
+
+# Local OpenAI-compatible stub (embeddings and chat) for development, load
+# tests and benchmarks.
+# Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8001/v1.
+# Embeddings are deterministic feature-hashed bag-of-words vectors, so texts
+# sharing words land close together and retrieval results are meaningful.
+
+STUB_PORT = getenv_int("STUB_PORT", 8001)
+STUB_LATENCY_MS = getenv_int("STUB_LATENCY_MS", 0)
+# Latency of each chat completion, the dominant cost of /ask with a real model
+STUB_CHAT_LATENCY_MS = getenv_int("STUB_CHAT_LATENCY_MS", 0)
+# Delay between streamed tokens (stream=True), to exercise time-to-first-token
+STUB_TOKEN_LATENCY_MS = getenv_int("STUB_TOKEN_LATENCY_MS", 0)
+# Answer every Nth embeddings request with a 429 (0 disables)
+STUB_RATE_LIMIT_EVERY = getenv_int("STUB_RATE_LIMIT_EVERY", 0)
+
+MODEL_DIMS = {"text-embedding-3-small": 1536, "text-embedding-3-large": 3072}
+WORD_RE = re.compile(r"\w+")
+QUESTION_RE = re.compile(r"Question: (.*)")
+
+app = FastAPI()
+_requests = itertools.count(1)
+_chat_requests = itertools.count(1)
+
+
+def stub_embedding(text: str, dim: int) -> np.ndarray:
+    vec = np.zeros(dim, dtype=np.float32)
+    for word in WORD_RE.findall(text.lower()):
+        h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+        vec[h % dim] += 1.0 if (h >> 63) & 1 else -1.0
+    norm = float(np.linalg.norm(vec))
+    if norm == 0.0:
+        vec[0] = 1.0
+        norm = 1.0
+    return vec / norm
+
+
+async def _delay() -> None:
+    if STUB_LATENCY_MS > 0:
+        await asyncio.sleep(STUB_LATENCY_MS / 1000.0)
+
+
+@app.post("/v1/embeddings")
+async def embeddings(payload: dict) -> JSONResponse:
+    n = next(_requests)
+    if STUB_RATE_LIMIT_EVERY and n % STUB_RATE_LIMIT_EVERY == 0:
+        return JSONResponse(
+            {"error": {"message": "Rate limit reached (stub)", "type": "requests", "code": "rate_limit_exceeded"}},
+            status_code=429,
+            headers={"retry-after": "0.05"},
+        )
+    await _delay()
+    model = payload.get("model", "text-embedding-3-small")
+    inputs: Union[str, List[str]] = payload.get("input", [])
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    dim = MODEL_DIMS.get(model, 1536)
+    # Like text-embedding-3, a shorter vector is the full one truncated and renormalized
+    dimensions = int(payload.get("dimensions") or dim)
+    # The SDK asks for base64 (packed float32) when numpy is installed
+    as_base64 = payload.get("encoding_format") == "base64"
+    data = []
+    for i, t in enumerate(inputs):
+        vec = stub_embedding(t, dim)[:dimensions]
+        vec = vec / (float(np.linalg.norm(vec)) or 1.0)
+        emb = base64.b64encode(vec.astype(np.float32).tobytes()).decode("ascii") if as_base64 else vec.tolist()
+        data.append({"object": "embedding", "index": i, "embedding": emb})
+    tokens = sum(len(WORD_RE.findall(t)) for t in inputs)
+    return JSONResponse({
+        "object": "list",
+        "data": data,
+        "model": model,
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    })
+
+
+def stub_answer(messages: List[dict]) -> str:
+    # Echo the question back with a citation, in the shape /ask expects
+    prompt = messages[-1].get("content", "") if messages else ""
+    m = QUESTION_RE.search(prompt)
+    question = m.group(1).strip() if m else "the question"
+    cite = " [1]" if "[1]" in prompt else ""
+    return f"Stub answer about {question}{cite}."
+
+
+async def _stream_chunks(answer: str, model: str) -> AsyncIterator[str]:
+    base = {"id": f"chatcmpl-stub-{next(_chat_requests)}", "object": "chat.completion.chunk",
+            "created": int(time.time()), "model": model}
+    deltas = [{"role": "assistant", "content": ""}] + [{"content": t} for t in re.findall(r"\S+\s*", answer)]
+    for i, delta in enumerate(deltas):
+        if i and STUB_TOKEN_LATENCY_MS > 0:
+            await asyncio.sleep(STUB_TOKEN_LATENCY_MS / 1000.0)
+        chunk = dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}])
+        yield f"data: {json.dumps(chunk)}\n\n"
+    chunk = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+    yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(payload: dict) -> JSONResponse:
+    if STUB_CHAT_LATENCY_MS > 0:
+        await asyncio.sleep(STUB_CHAT_LATENCY_MS / 1000.0)
+    messages = payload.get("messages", [])
+    answer = stub_answer(messages)
+    if payload.get("stream"):
+        return StreamingResponse(_stream_chunks(answer, payload.get("model", "stub")), media_type="text/event-stream")
+    prompt_tokens = sum(len(WORD_RE.findall(str(m.get("content", "")))) for m in messages)
+    completion_tokens = len(WORD_RE.findall(answer))
+    return JSONResponse({
+        "id": f"chatcmpl-stub-{next(_chat_requests)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", "stub"),
+        "choices": [
+            {"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    })
+
+
+if __name__ == "__main__":
+    uvicorn.run("src.stub_openai:app", host="127.0.0.1", port=STUB_PORT, reload=False)
@@ -1,29 +1,45 @@
 from pathlib import Path
-from typing import List, Tuple, Iterable
+from typing import Iterator, List, Optional, Tuple
 
 import pdfplumber
+from pdfminer.pdftypes import resolve1
 from docx import Document as DocxDocument
 
 
+def iter_pdf_pages(path: Path, first_page: int = 1, last_page: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    # Yield (page number, text) one page at a time, optionally for a 1-based
+    # inclusive page range. Each page's parsed layout is dropped before the
+    # next is read, so memory stays flat however long the document is.
+    pages = range(first_page, last_page + 1) if last_page is not None else None
+    with pdfplumber.open(str(path), pages=pages) as pdf:
+        for page in pdf.pages:
+            try:
+                text = page.extract_text() or ""
+            finally:
+                page.close()
+            yield page.page_number, text
+
+
+def pdf_page_count(path: Path) -> int:
+    with pdfplumber.open(str(path)) as pdf:
+        try:
+            return int(resolve1(pdf.doc.catalog["Pages"])["Count"])
+        except Exception:  # noqa: BLE001
+            return len(pdf.pages)
+
+
 def extract_pdf(path: Path) -> Tuple[str, List[int]]:
     texts: List[str] = []
     pages: List[int] = []
-    with pdfplumber.open(str(path)) as pdf:
-        for i, page in enumerate(pdf.pages, start=1):
-            text = page.extract_text() or ""
-            texts.append(text)
-            pages.append(i)
+    for i, text in iter_pdf_pages(path):
+        texts.append(text)
+        pages.append(i)
     full_text = "\n\n".join(texts)
     return full_text, pages
 
 
-def extract_pdf_pages(path: Path) -> List[Tuple[int, str]]:
-    results: List[Tuple[int, str]] = []
-    with pdfplumber.open(str(path)) as pdf:
-        for i, page in enumerate(pdf.pages, start=1):
-            text = page.extract_text() or ""
-            results.append((i, text))
-    return results
+def extract_pdf_pages(path: Path) -> Iterator[Tuple[int, str]]:
+    return iter_pdf_pages(path)
 
 
 def extract_docx(path: Path) -> str:
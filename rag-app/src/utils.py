@@ -3,6 +3,7 @@ import os
 import re
 import time
 import uuid
+from functools import lru_cache
 from pathlib import Path
 from typing import Iterable, Tuple
 
@@ -42,6 +43,37 @@ def normalize_whitespace(text: str) -> str:
     return re.sub(r"\s+", " ", text).strip()
 
 
+@lru_cache(maxsize=8)
+def token_encoding(model: str):
+    try:
+        import tiktoken  # type: ignore
+
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:  # noqa: BLE001
+        # tiktoken missing or its BPE files can't be fetched (offline)
+        return None
+
+
+def count_tokens(text: str, model: str) -> int:
+    enc = token_encoding(model)
+    if enc is None:
+        return len(text) // 4 + 1
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, model: str, max_tokens: int) -> str:
+    enc = token_encoding(model)
+    if enc is None:
+        return text[: max(0, max_tokens) * 4]
+    tokens = enc.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return enc.decode(tokens[: max(0, max_tokens)])
+
+
 def chunk_text(text: str, size: int, overlap: int) -> Iterable[Tuple[int, str]]:
     if size <= 0:
         yield (0, text)
@@ -0,0 +1,194 @@
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .config import EMBED_PRECISION, VECTORS_PATH
+
+try:
+    import fcntl  # type: ignore
+except ImportError:  # Windows: appends are only serialized within the process
+    fcntl = None  # type: ignore
+
+
+# Append-only file of unit-length embeddings, one fixed-size row per vector,
+# memory-mapped for reads. chunks.vec_row in SQLite points at a row. Rows are
+# written and fsynced before the SQLite transaction that references them
+# commits, so a committed pointer always has its vector on disk; a crash in
+# between only leaves unreferenced rows at the tail.
+_MAGIC = b"RAGVEC1\0"
+_HEADER = struct.Struct("<8sI8s")
+_HEADER_SIZE = 64
+
+# Storage precision of a row. int8 rows are scaled so their largest
+# component is +-127; the scale isn't kept since only the direction matters
+# for cosine similarity, and decoding renormalizes.
+PRECISIONS = {"float32": np.dtype(np.float32), "float16": np.dtype(np.float16), "int8": np.dtype(np.int8)}
+
+
+def encode_vectors(vectors: np.ndarray, precision: str) -> np.ndarray:
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision} (expected one of {', '.join(PRECISIONS)})")
+    x = np.array(vectors, dtype=np.float32, ndmin=2)
+    x /= np.linalg.norm(x, axis=1, keepdims=True) + 1e-12
+    if precision == "float16":
+        return x.astype(np.float16)
+    if precision == "int8":
+        scale = 127.0 / (np.abs(x).max(axis=1, keepdims=True) + 1e-12)
+        return np.clip(np.rint(x * scale), -127, 127).astype(np.int8)
+    return x
+
+
+def decode_vectors(vectors: np.ndarray) -> np.ndarray:
+    # Unit-length float32; float32 input is returned as is (no copy)
+    if vectors.dtype == np.float32:
+        return vectors
+    x = np.array(vectors, dtype=np.float32, ndmin=2)
+    x /= np.linalg.norm(x, axis=1, keepdims=True) + 1e-12
+    return x
+
+
+class VectorStore:
+    def __init__(self, path: Path = VECTORS_PATH, precision: str = EMBED_PRECISION) -> None:
+        self.path = path
+        # Only used when creating the file; an existing file keeps its own
+        self.precision = precision
+        self._lock = threading.Lock()
+        self._mm: Optional[np.memmap] = None
+        self._dim: Optional[int] = None
+        self._dtype: Optional[np.dtype] = None
+
+    def _read_header(self) -> None:
+        if self._dim is not None or not self.path.exists() or self.path.stat().st_size < _HEADER_SIZE:
+            return
+        with open(self.path, "rb") as f:
+            magic, dim, dtype = _HEADER.unpack(f.read(_HEADER.size))
+        name = dtype.rstrip(b"\0").decode()
+        if magic != _MAGIC or name not in PRECISIONS:
+            raise ValueError(f"{self.path} is not a vector store")
+        self._dim, self._dtype = int(dim), PRECISIONS[name]
+
+    @property
+    def dim(self) -> Optional[int]:
+        self._read_header()
+        return self._dim
+
+    @property
+    def dtype(self) -> np.dtype:
+        self._read_header()
+        return self._dtype if self._dtype is not None else PRECISIONS[self.precision]
+
+    def __len__(self) -> int:
+        dim = self.dim
+        if dim is None:
+            return 0
+        return (self.path.stat().st_size - _HEADER_SIZE) // (dim * self.dtype.itemsize)
+
+    def append(self, vectors: np.ndarray) -> np.ndarray:
+        # Normalizes and encodes in the file's precision, appends and returns
+        # the row number of each vector
+        dtype = self.dtype
+        vectors = encode_vectors(vectors, dtype.name)
+        n, dim = vectors.shape
+        row_bytes = dim * dtype.itemsize
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.path, "a+b") as f:
+            if fcntl is not None:
+                # Other processes (a CLI worker next to the web app) append too
+                fcntl.flock(f, fcntl.LOCK_EX)
+            size = os.fstat(f.fileno()).st_size
+            if size < _HEADER_SIZE:
+                f.truncate(0)
+                f.write(_header(dim, dtype))
+                size = _HEADER_SIZE
+                self._dim, self._dtype = dim, dtype
+            elif self.dim != dim:
+                raise ValueError(
+                    f"Vector store holds {self.dim}-dim vectors, got {dim}-dim (see migrate-dimensions)"
+                )
+            start = (size - _HEADER_SIZE) // row_bytes
+            if size != _HEADER_SIZE + start * row_bytes:
+                # Torn write from a crash; those rows were never referenced
+                f.truncate(_HEADER_SIZE + start * row_bytes)
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        return np.arange(start, start + n, dtype=np.int64)
+
+    def matrix(self) -> np.ndarray:
+        # Read-only (rows, dim) view of the whole file in its stored
+        # precision; remapped as it grows
+        dim = self.dim
+        if dim is None:
+            return np.zeros((0, 0), dtype=self.dtype)
+        rows = len(self)
+        if rows == 0:
+            return np.zeros((0, dim), dtype=self.dtype)
+        mm = self._mm
+        if mm is None or mm.shape[0] < rows:
+            mm = np.memmap(self.path, dtype=self.dtype, mode="r", offset=_HEADER_SIZE, shape=(rows, dim))
+            self._mm = mm
+        return mm
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        # Stored vectors for the given rows, in that order (see decode_vectors).
+        # A run of consecutive rows is returned as a zero-copy view of the mapping.
+        rows = np.asarray(rows, dtype=np.int64)
+        mm = self.matrix()
+        if rows.size == 0:
+            return np.zeros((0, mm.shape[1]), dtype=mm.dtype)
+        first = int(rows[0])
+        if int(rows[-1]) - first + 1 == rows.size and np.all(np.diff(rows) == 1):
+            return mm[first:first + rows.size]
+        return mm[rows]
+
+    def convert(self, precision: str, dim: Optional[int] = None, batch_size: int = 65536) -> int:
+        # Rewrite every row in another precision and/or truncated to its first
+        # dim components (Matryoshka-style, renormalized). Row numbers don't
+        # change, so chunks.vec_row stays valid; the new file replaces the old
+        # one atomically. Other processes must not be using the store meanwhile.
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision} (expected one of {', '.join(PRECISIONS)})")
+        self.precision = precision
+        if self.dim is None:
+            return 0
+        dim = dim or self.dim
+        if dim > self.dim:
+            raise ValueError(f"Can't widen {self.dim}-dim vectors to {dim}; re-ingest instead")
+        if self.dtype.name == precision and dim == self.dim:
+            return 0
+        dtype = PRECISIONS[precision]
+        tmp = self.path.with_suffix(".tmp")
+        with self._lock:
+            src = self.matrix()
+            with open(tmp, "wb") as f:
+                f.write(_header(dim, dtype))
+                for start in range(0, src.shape[0], batch_size):
+                    batch = decode_vectors(src[start:start + batch_size, :dim])
+                    f.write(encode_vectors(batch, precision).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self._mm = None
+            self._dim, self._dtype = dim, dtype
+        return int(src.shape[0])
+
+
+def _header(dim: int, dtype: np.dtype) -> bytes:
+    return _HEADER.pack(_MAGIC, dim, dtype.name.encode()).ljust(_HEADER_SIZE, b"\0")
+
+
+_store: Optional[VectorStore] = None
+_store_lock = threading.Lock()
+
+
+def get_vector_store() -> VectorStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = VectorStore()
+    return _store
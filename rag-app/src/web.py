@@ -1,22 +1,28 @@
+import asyncio
+import json
 import os
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 from dotenv import load_dotenv
 from fastapi import FastAPI, File, Form, HTTPException, Query, Request, UploadFile
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
+import numpy as np
 import uvicorn
 
-from . import db
-from .config import HOST, PORT, UPLOADS_PATH
-from .generate import generate_answer
-from .retrieve import retrieve
+from . import db, metrics
+from .config import ASK_BATCH_MAX_QUERIES, HOST, PORT, RERANKER, RETRIEVAL_MODE, UPLOADS_PATH
+from .answer_cache import cached_answer, hit_rate, store_answer
+from .generate import GenerateResult, agenerate_answer, astream_answer, citations_for
+from .rerank import RERANKERS, get_cross_encoder
+from .retrieve import RETRIEVAL_MODES, RetrievedChunk, retrieve_with_vectors
 from .utils import compute_sha256_bytes, new_id, now_iso, safe_filename
-from .worker import get_status, start_processing
-from .embed_index import build_faiss_index, save_index
-from .config import EMBED_MODEL
-import numpy as np
+from .worker import get_status, start_processing, start_workers
+from .embed_index import query_cache_size
+from .index_holder import IndexMismatch, index_holder
+from .indexer import rebuild_index
 
 
 load_dotenv()
@@ -32,6 +38,17 @@ app = FastAPI()
 @app.on_event("startup")
 def _init_db() -> None:
     db.init_db()
+    index_holder.get()
+    if RERANKER == "cross_encoder":
+        # Load the model now rather than on the first query
+        get_cross_encoder()
+    start_workers()
+
+
+@app.exception_handler(IndexMismatch)
+async def _index_mismatch(request: Request, exc: IndexMismatch) -> JSONResponse:
+    # The index needs reindex/migrate-dimensions; don't rebuild per request
+    return JSONResponse({"detail": str(exc)}, status_code=503)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -110,6 +127,7 @@ def status(job_id: str = Query(...)) -> JSONResponse:
         "processed_docs": st.processed_docs,
         "total_chunks": st.total_chunks,
         "embedded_chunks": st.embedded_chunks,
+        "stages": st.stages,
         "error": st.error,
     })
 
@@ -120,14 +138,26 @@ def documents() -> JSONResponse:
     return JSONResponse(docs)
 
 
-@app.post("/ask")
-async def ask(payload: dict) -> JSONResponse:
-    query = payload.get("query", "").strip()
-    if not query:
-        raise HTTPException(status_code=400, detail="Missing query")
-    k = int(payload.get("k", 5))
-    retrieved = retrieve(query, k=k)
-    retrieved_dicts = [
+def _retrieval_options(payload: dict) -> Dict[str, Any]:
+    nprobe = payload.get("nprobe")
+    ef_search = payload.get("ef_search")
+    mode = payload.get("mode", RETRIEVAL_MODE)
+    if mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(RETRIEVAL_MODES)}")
+    reranker = payload.get("reranker", RERANKER)
+    if reranker not in RERANKERS:
+        raise HTTPException(status_code=400, detail=f"reranker must be one of {', '.join(RERANKERS)}")
+    return {
+        "k": int(payload.get("k", 5)),
+        "nprobe": int(nprobe) if nprobe is not None else None,
+        "ef_search": int(ef_search) if ef_search is not None else None,
+        "mode": mode,
+        "reranker": reranker,
+    }
+
+
+def _retrieved_dicts(retrieved: List[RetrievedChunk]) -> List[Dict[str, Any]]:
+    return [
         {
             "document_id": r.document_id,
             "filename": r.filename,
@@ -138,7 +168,30 @@ async def ask(payload: dict) -> JSONResponse:
         }
         for r in retrieved
     ]
-    gen = generate_answer(query, retrieved_dicts)
+
+
+async def _retrieve_for(payload: dict) -> Tuple[str, Optional[np.ndarray], List[Dict[str, Any]]]:
+    query = payload.get("query", "").strip()
+    if not query:
+        raise HTTPException(status_code=400, detail="Missing query")
+    options = _retrieval_options(payload)
+    # Retrieval is blocking (FAISS, SQLite, embedding call); keep it off the event loop
+    retrieved, q_vecs = await run_in_threadpool(retrieve_with_vectors, [query], **options)
+    return query, q_vecs, _retrieved_dicts(retrieved[0])
+
+
+async def _answer(query: str, q_vec: Optional[np.ndarray], retrieved_dicts: List[Dict[str, Any]]) -> GenerateResult:
+    key, gen = await run_in_threadpool(cached_answer, q_vec, retrieved_dicts)
+    if gen is None:
+        gen = await agenerate_answer(query, retrieved_dicts)
+        await run_in_threadpool(store_answer, key, query, gen)
+    return gen
+
+
+@app.post("/ask")
+async def ask(payload: dict) -> JSONResponse:
+    query, q_vecs, retrieved_dicts = await _retrieve_for(payload)
+    gen = await _answer(query, q_vecs, retrieved_dicts)
     return JSONResponse({
         "answer": gen.answer,
         "citations": [c.__dict__ for c in gen.citations],
@@ -146,16 +199,87 @@ async def ask(payload: dict) -> JSONResponse:
     })
 
 
+@app.post("/ask_batch")
+async def ask_batch(payload: dict) -> JSONResponse:
+    # Several questions with shared options: retrieved together in one
+    # batch, then answered concurrently (still at most LLM_CONCURRENCY
+    # chat calls in flight). Results come back in question order.
+    queries = payload.get("queries")
+    if not isinstance(queries, list) or not queries:
+        raise HTTPException(status_code=400, detail="Missing queries")
+    queries = [str(q).strip() for q in queries]
+    if not all(queries):
+        raise HTTPException(status_code=400, detail="Empty query in batch")
+    if len(queries) > ASK_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {ASK_BATCH_MAX_QUERIES} queries per batch")
+    options = _retrieval_options(payload)
+    retrieved, q_vecs = await run_in_threadpool(retrieve_with_vectors, queries, **options)
+    retrieved_dicts = [_retrieved_dicts(r) for r in retrieved]
+    gens = await asyncio.gather(*(
+        _answer(q, q_vecs[i:i + 1] if q_vecs is not None else None, r)
+        for i, (q, r) in enumerate(zip(queries, retrieved_dicts))
+    ))
+    return JSONResponse([
+        {
+            "query": q,
+            "answer": gen.answer,
+            "citations": [c.__dict__ for c in gen.citations],
+            "retrieved": r,
+        }
+        for q, gen, r in zip(queries, gens, retrieved_dicts)
+    ])
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/ask/stream")
+async def ask_stream(payload: dict) -> StreamingResponse:
+    # Server-Sent Events: one "context" event with citations and retrieved
+    # chunks, "token" events as the answer is generated, then "done"
+    query, q_vecs, retrieved_dicts = await _retrieve_for(payload)
+    key, cached = await run_in_threadpool(cached_answer, q_vecs, retrieved_dicts)
+
+    async def events() -> AsyncIterator[str]:
+        citations = cached.citations if cached is not None else citations_for(retrieved_dicts)
+        yield _sse("context", {"citations": [c.__dict__ for c in citations], "retrieved": retrieved_dicts})
+        if cached is not None:
+            yield _sse("token", {"text": cached.answer})
+            yield _sse("done", {"answer": cached.answer})
+            return
+        parts: List[str] = []
+        try:
+            async for delta in astream_answer(query, retrieved_dicts):
+                parts.append(delta)
+                yield _sse("token", {"text": delta})
+        except Exception as e:  # noqa: BLE001
+            yield _sse("error", {"detail": str(e)})
+            return
+        answer = "".join(parts).strip()
+        await run_in_threadpool(store_answer, key, query, GenerateResult(answer=answer, citations=citations))
+        yield _sse("done", {"answer": answer})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.post("/reindex")
 def reindex() -> JSONResponse:
-    rows = db.all_chunks_with_embeddings()
-    if not rows:
-        return JSONResponse({"ok": True, "indexed": 0})
-    vectors = np.vstack([np.frombuffer(r["embedding"], dtype=np.float32) for r in rows])
-    index = build_faiss_index(vectors)
-    meta = {"model": EMBED_MODEL, "dim": str(vectors.shape[1])}
-    save_index(index, meta)
-    return JSONResponse({"ok": True, "indexed": len(rows)})
+    indexed = rebuild_index()
+    return JSONResponse({"ok": True, "indexed": indexed})
+
+
+@app.get("/metrics")
+def get_metrics() -> JSONResponse:
+    counters = metrics.snapshot()
+    counters["query_cache.size"] = query_cache_size()
+    counters["answer_cache.hit_rate"] = hit_rate()
+    counters["timings"] = metrics.timings()
+    return JSONResponse(counters)
 
 
 @app.get("/chunk")
@@ -169,6 +293,7 @@ def get_chunk(document_id: str, chunk_id: int) -> JSONResponse:
         "chunk_id": r["chunk_id"],
         "text": r["text"],
         "page": r["page"],
+        "vector_id": r["vector_id"],
     })
 
 
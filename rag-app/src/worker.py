@@ -1,17 +1,34 @@
+import json
+import multiprocessing
+import os
+import queue
+import socket
 import threading
+import time
 import traceback
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
 
-import numpy as np
 from pathlib import Path
 
 from . import db
 from .chunk import chunk_document
-from .config import EMBED_MODEL
-from .embed_index import build_faiss_index, embed_texts, save_index
-from .text_extract import extract_text_and_pages, extract_pdf_pages
-from .utils import new_id
+from .config import (
+    EMBED_STAGE_WORKERS,
+    EXTRACT_WORKERS,
+    JOB_LEASE_S,
+    JOB_POLL_S,
+    JOB_WORKERS,
+    PDF_PAGES_PER_TASK,
+    PIPELINE_QUEUE_SIZE,
+)
+from .embed_index import embed_texts
+from .indexer import update_index
+from .text_extract import extract_text_and_pages, iter_pdf_pages, pdf_page_count
+from .utils import new_id, now_iso
+from .vector_store import get_vector_store
 
 
 @dataclass
@@ -22,12 +39,30 @@ class JobStatus:
     processed_docs: List[str] = field(default_factory=list)
     total_chunks: int = 0
     embedded_chunks: int = 0
+    # Segments (a whole document, or a page range of a PDF) through each pipeline stage
+    stages: Dict[str, int] = field(
+        default_factory=lambda: {"segments": 0, "extracted": 0, "embedded": 0, "persisted": 0}
+    )
     error: Optional[str] = None
 
 
-_jobs: Dict[str, JobStatus] = {}
+# Status of jobs running in this process; everything else is read from the DB
+_running: Dict[str, JobStatus] = {}
 _lock = threading.Lock()
 
+_workers: List[threading.Thread] = []
+_wake = threading.Event()
+
+_extract_pool: Optional[ProcessPoolExecutor] = None
+_extract_pool_lock = threading.Lock()
+
+_DONE = object()
+
+
+class _Committed(NamedTuple):
+    # Placeholder for a segment checkpointed by an earlier run of the job
+    chunk_count: int
+
 
 def start_processing(doc_ids: Optional[List[str]] = None) -> str:
     if doc_ids is None:
@@ -36,104 +71,351 @@ def start_processing(doc_ids: Optional[List[str]] = None) -> str:
         doc_ids = [d["id"] for d in docs if d["status"] in ("PENDING", "NEEDS_PROCESSING")]
 
     job_id = new_id("job")
-    status = JobStatus(job_id=job_id, state="queued", queued_docs=list(doc_ids))
-    with _lock:
-        _jobs[job_id] = status
-
-    t = threading.Thread(target=_run_job, args=(job_id, doc_ids), daemon=True)
-    t.start()
+    db.create_job(job_id, list(doc_ids), now_iso())
+    _wake.set()
     return job_id
 
 
 def get_status(job_id: str) -> Optional[JobStatus]:
     with _lock:
-        return _jobs.get(job_id)
+        live = _running.get(job_id)
+    if live is not None:
+        return live
+    job = db.get_job(job_id)
+    if job is None:
+        return None
+    docs = db.job_documents(job_id)
+    status = JobStatus(
+        job_id=job_id,
+        state=job["state"],
+        queued_docs=[d["document_id"] for d in docs],
+        processed_docs=[d["document_id"] for d in docs if d["state"] == "done"],
+        total_chunks=job["total_chunks"] or 0,
+        embedded_chunks=job["embedded_chunks"] or 0,
+        error=job["error"],
+    )
+    if job["stages"]:
+        status.stages.update(json.loads(job["stages"]))
+    return status
 
 
-def _run_job(job_id: str, doc_ids: List[str]) -> None:
-    status = get_status(job_id)
-    if status is None:
-        return
-    status.state = "processing"
+def start_workers(n: int = JOB_WORKERS) -> None:
+    # Keep n job worker threads running in this process
+    with _lock:
+        _workers[:] = [t for t in _workers if t.is_alive()]
+        for i in range(len(_workers), n):
+            worker_id = f"{socket.gethostname()}:{os.getpid()}:{i}"
+            t = threading.Thread(target=run_worker, args=(worker_id,), daemon=True)
+            t.start()
+            _workers.append(t)
+
+
+def run_worker(worker_id: str, stop: Optional[threading.Event] = None, once: bool = False) -> None:
+    # Claim and run jobs until stopped; with once=True, return when the queue is empty
+    while stop is None or not stop.is_set():
+        job_id = db.claim_job(worker_id, time.time(), JOB_LEASE_S)
+        if job_id is None:
+            if once:
+                return
+            _wake.wait(JOB_POLL_S)
+            _wake.clear()
+            continue
+        _run_job(job_id, worker_id)
+
+
+def extract_chunks(
+    path: str, ext: str, first_page: Optional[int] = None, last_page: Optional[int] = None
+) -> List[Tuple[Optional[int], str]]:
+    # Runs in an extraction process: parse and chunk one document, or one page
+    # range of a PDF, into (page, chunk text) pairs. Pages are chunked as they
+    # are parsed so only the current page's text is held at once.
+    ext = ext.lower()
+    pieces: List[Tuple[Optional[int], str]] = []
+    if ext == "pdf":
+        for page_num, page_text in iter_pdf_pages(Path(path), first_page or 1, last_page):
+            for _, ctext in chunk_document(page_text):
+                pieces.append((page_num, ctext))
+    else:
+        text, _ = extract_text_and_pages(Path(path), ext)
+        for _, ctext in chunk_document(text):
+            pieces.append((None, ctext))
+    return pieces
+
+
+def _segments(path: str, ext: str) -> List[Tuple[Optional[int], Optional[int]]]:
+    if ext.lower() != "pdf" or PDF_PAGES_PER_TASK <= 0:
+        return [(None, None)]
+    n = pdf_page_count(Path(path))
+    step = PDF_PAGES_PER_TASK
+    return [(start, min(start + step - 1, n)) for start in range(1, n + 1, step)] or [(None, None)]
+
+
+def _get_extract_pool() -> Optional[ProcessPoolExecutor]:
+    global _extract_pool
+    if EXTRACT_WORKERS <= 0:
+        return None
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            # spawn, not fork: the parent runs web/worker threads and holds SQLite handles
+            _extract_pool = ProcessPoolExecutor(
+                max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _extract_pool
+
+
+def _reset_extract_pool() -> None:
+    # A crashed extraction process (e.g. OOM on a huge PDF) breaks the whole pool
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is not None:
+            _extract_pool.shutdown(wait=False, cancel_futures=True)
+            _extract_pool = None
+
+
+def _put(q: "queue.Queue", item: Any, stop: threading.Event) -> bool:
+    # Blocking put that gives up once the job is being torn down
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.2)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: "queue.Queue", stop: threading.Event) -> Any:
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.2)
+        except queue.Empty:
+            continue
+    return _DONE
+
 
+@dataclass
+class _Pipeline:
+    job_id: str
+    status: JobStatus
+    extracted: "queue.Queue"
+    embedded: "queue.Queue"
+    stop: threading.Event = field(default_factory=threading.Event)
+    errors: List[BaseException] = field(default_factory=list)
+    # Segments of a document are numbered in submission order under seq_lock
+    seq_lock: threading.Lock = field(default_factory=threading.Lock)
+    next_chunk: Dict[str, int] = field(default_factory=dict)
+    pending_segments: Dict[str, int] = field(default_factory=dict)
+    # Documents whose extraction failed; their remaining segments are dropped
+    failed: Set[str] = field(default_factory=set)
+
+
+def _feed(doc_ids: List[str], p: _Pipeline) -> None:
+    # Stage 1: hand documents (PDFs split into page ranges) to the extraction
+    # pool. The bounded queue of pending futures caps how far parsing runs
+    # ahead of embedding.
+    status = p.status
     try:
-        # Extract, chunk, embed for each doc
+        pool = _get_extract_pool()
         for doc_id in doc_ids:
             d = db.get_document(doc_id)
             if not d:
+                db.finish_job_document(p.job_id, doc_id, "error", "MISSING")
                 continue
             if d["status"] == "DUPLICATE":
+                db.finish_job_document(p.job_id, doc_id, "done", "DUPLICATE")
                 status.processed_docs.append(doc_id)
                 continue
             try:
-                path = Path(d["path"])
-                ext = d["ext"].lower()
-                rows = []
-                cid_counter = 0
-                if ext == "pdf":
-                    for page_num, page_text in extract_pdf_pages(path):
-                        for offset, ctext in chunk_document(page_text):
-                            rows.append({
-                                "id": f"chunk_{doc_id}_{cid_counter}",
-                                "document_id": doc_id,
-                                "chunk_id": cid_counter,
-                                "text": ctext,
-                                "page": page_num,
-                                "embedding": None,
-                            })
-                            cid_counter += 1
+                segments = _segments(d["path"], d["ext"])
+            except Exception as e:  # noqa: BLE001
+                db.finish_job_document(p.job_id, doc_id, "error", f"ERROR: {e}")
+                continue
+            committed = db.committed_segments(doc_id)
+            with _lock:
+                p.pending_segments[doc_id] = len(segments)
+                status.stages["segments"] += len(segments)
+            for first, last in segments:
+                if doc_id in p.failed:
+                    break
+                key = (first or 0, last or 0)
+                fut: Future = Future()
+                if key in committed:
+                    fut.set_result(_Committed(committed[key]))
+                elif pool is not None:
+                    fut = pool.submit(extract_chunks, d["path"], d["ext"], first, last)
                 else:
-                    text, _ = extract_text_and_pages(path, ext)
-                    for offset, ctext in chunk_document(text):
-                        rows.append({
-                            "id": f"chunk_{doc_id}_{cid_counter}",
-                            "document_id": doc_id,
-                            "chunk_id": cid_counter,
-                            "text": ctext,
-                            "page": None,
-                            "embedding": None,
-                        })
-                        cid_counter += 1
-            except Exception as e:
-                db.update_document_status(doc_id, f"ERROR: {e}")
+                    try:
+                        fut.set_result(extract_chunks(d["path"], d["ext"], first, last))
+                    except Exception as e:  # noqa: BLE001
+                        fut.set_exception(e)
+                if not _put(p.extracted, (doc_id, key, fut), p.stop):
+                    return
+    except Exception as e:  # noqa: BLE001
+        p.errors.append(e)
+    finally:
+        for _ in range(max(1, EMBED_STAGE_WORKERS)):
+            _put(p.extracted, _DONE, p.stop)
+
+
+def _embed(p: _Pipeline) -> None:
+    # Stage 2: wait for a segment's chunks, number them, and embed the ones
+    # without a stored vector
+    status = p.status
+    try:
+        while True:
+            with p.seq_lock:
+                item = _get(p.extracted, p.stop)
+                if item is _DONE:
+                    return
+                doc_id, key, fut = item
+                if doc_id in p.failed:
+                    # The writer discards the document; don't pay to embed it
+                    fut.cancel()
+                    continue
+                try:
+                    pieces = fut.result()
+                except BrokenProcessPool as e:
+                    _reset_extract_pool()
+                    _put(p.embedded, ("fatal", doc_id, e), p.stop)
+                    return
+                except Exception as e:  # noqa: BLE001
+                    p.failed.add(doc_id)
+                    _put(p.embedded, ("extract_error", doc_id, e), p.stop)
+                    continue
+                start = p.next_chunk.get(doc_id, 0)
+                if isinstance(pieces, _Committed):
+                    # Already persisted by an earlier run; only keep numbering in step
+                    p.next_chunk[doc_id] = start + pieces.chunk_count
+                    with _lock:
+                        for stage in ("extracted", "embedded", "persisted"):
+                            status.stages[stage] += 1
+                    _put(p.embedded, ("committed", doc_id, None), p.stop)
+                    continue
+                p.next_chunk[doc_id] = start + len(pieces)
+            rows = [
+                {
+                    "id": f"chunk_{doc_id}_{cid}",
+                    "document_id": doc_id,
+                    "chunk_id": cid,
+                    "text": ctext,
+                    "page": page,
+                    "vec_row": None,
+                }
+                for cid, (page, ctext) in enumerate(pieces, start=start)
+            ]
+            # Chunks already embedded with the same text are left as they are;
+            # new or changed ones are embedded and upserted
+            have = db.embedded_chunk_texts([r["id"] for r in rows])
+            missing = [r for r in rows if have.get(r["id"]) != r["text"]]
+            with _lock:
+                status.stages["extracted"] += 1
+                status.total_chunks += len(missing)
+            try:
+                if missing:
+                    # On disk before the writer commits the rows pointing at them
+                    vec_rows = get_vector_store().append(embed_texts([r["text"] for r in missing]))
+                    for r, vec_row in zip(missing, vec_rows):
+                        r["vec_row"] = int(vec_row)
+            except Exception as e:  # noqa: BLE001
+                _put(p.embedded, ("fatal", doc_id, e), p.stop)
+                return
+            with _lock:
+                status.stages["embedded"] += 1
+            _put(p.embedded, ("ok", doc_id, (key, start, len(rows), missing)), p.stop)
+    finally:
+        _put(p.embedded, _DONE, p.stop)
+
+
+def _run_job(job_id: str, worker_id: str) -> None:
+    status = get_status(job_id)
+    if status is None:
+        return
+    status.state = "processing"
+    status.error = None
+    # Stage counts describe this run. embedded_chunks carries over a resume
+    # (it commits with each segment); total_chunks restarts from it, since
+    # segments embedded but not committed last time are counted again
+    status.stages = {k: 0 for k in status.stages}
+    status.total_chunks = status.embedded_chunks
+    with _lock:
+        _running[job_id] = status
+    todo = [d["document_id"] for d in db.job_documents(job_id) if d["state"] == "queued"]
+
+    p = _Pipeline(
+        job_id=job_id,
+        status=status,
+        extracted=queue.Queue(maxsize=max(1, PIPELINE_QUEUE_SIZE)),
+        embedded=queue.Queue(maxsize=max(1, PIPELINE_QUEUE_SIZE)),
+    )
+    n_embedders = max(1, EMBED_STAGE_WORKERS)
+    threads = [
+        threading.Thread(target=_heartbeat, args=(job_id, worker_id, p.stop), daemon=True),
+        threading.Thread(target=_feed, args=(todo, p), daemon=True),
+    ]
+    threads += [threading.Thread(target=_embed, args=(p,), daemon=True) for _ in range(n_embedders)]
+    for t in threads:
+        t.start()
+
+    try:
+        # Stage 3: this thread is the only writer. Each segment commits with
+        # its checkpoint; a document is READY once all its segments are in.
+        failed: Set[str] = set()
+        finished = 0
+        while finished < n_embedders:
+            item = p.embedded.get()
+            if item is _DONE:
+                finished += 1
+                continue
+            kind, doc_id, payload = item
+            if kind == "fatal":
+                # Embedding failures (API down, bad key) fail the whole job
+                raise payload
+            if kind == "extract_error":
+                if doc_id not in failed:
+                    failed.add(doc_id)
+                    db.finish_job_document(job_id, doc_id, "error", f"ERROR: {payload}")
                 continue
+            if doc_id in failed:
+                continue
+            if kind == "ok":
+                (first, last), start, chunk_count, rows = payload
+                db.insert_segment(job_id, doc_id, first, last, start, chunk_count, rows)
+                status.embedded_chunks += len(rows)
+                status.stages["persisted"] += 1
+            with _lock:
+                p.pending_segments[doc_id] -= 1
+                complete = p.pending_segments[doc_id] == 0
+            if complete:
+                db.finish_job_document(job_id, doc_id, "done", "READY")
+                status.processed_docs.append(doc_id)
+            _save_progress(job_id, status)
+        if p.errors:
+            raise p.errors[0]
 
-            db.insert_chunks_bulk(rows)
-
-            # Fetch all chunks for this doc and embed missing
-            doc_chunks = [r for r in db.chunks_for_document(doc_id)]
-            missing = [r for r in doc_chunks if r["embedding"] is None]
-            status.total_chunks += len(missing)
-            if missing:
-                vecs = embed_texts([r["text"] for r in missing])
-                for r, vec in zip(missing, vecs):
-                    db.insert_chunk(
-                        {
-                            "id": r["id"],
-                            "document_id": r["document_id"],
-                            "chunk_id": r["chunk_id"],
-                            "text": r["text"],
-                            "page": r["page"],
-                            "embedding": vec.tobytes(),
-                        }
-                    )
-                    status.embedded_chunks += 1
-
-            db.update_document_status(doc_id, "READY")
-            status.processed_docs.append(doc_id)
-
-        # Rebuild index from all embeddings
-        all_rows = db.all_chunks_with_embeddings()
-        if all_rows:
-            vectors = np.vstack([np.frombuffer(r["embedding"], dtype=np.float32) for r in all_rows])
-            index = build_faiss_index(vectors)
-            meta = {"model": EMBED_MODEL, "dim": str(vectors.shape[1])}
-            save_index(index, meta)
+        # Patch the index with just the documents this job touched
+        update_index(status.processed_docs)
 
         status.state = "done"
+        _save_progress(job_id, status)
+        db.finish_job(job_id, "done")
     except Exception as e:  # noqa: BLE001
         status.state = "error"
         status.error = f"{e}\n{traceback.format_exc()}"
+        _save_progress(job_id, status)
+        db.finish_job(job_id, "error", status.error)
+    finally:
+        p.stop.set()
+        for t in threads:
+            t.join()
+        with _lock:
+            _running.pop(job_id, None)
 
-from pathlib import Path
 
+def _heartbeat(job_id: str, worker_id: str, stop: threading.Event) -> None:
+    while not stop.wait(JOB_LEASE_S / 3):
+        db.heartbeat_job(job_id, worker_id, time.time())
+
+
+def _save_progress(job_id: str, status: JobStatus) -> None:
+    with _lock:
+        stages = json.dumps(status.stages)
+    db.update_job_progress(job_id, status.total_chunks, status.embedded_chunks, stages)